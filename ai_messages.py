@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db
+import metrics
+
+MODEL = "llama3-8b-8192"
+# Groq calls in flight at once, and the sustained rate they are held to
+MAX_CONCURRENCY = 4
+RATE_PER_MINUTE = 30
+# Cached messages kept before the least recently used are evicted
+CACHE_LIMIT = 5000
+
+GROQ_SECONDS = metrics.Histogram('ledboard_groq_request_seconds', 'Groq chat completion latency.', ('purpose', 'outcome'))
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per `per` seconds, with bursts up to `rate`."""
+
+    def __init__(self, rate, per=60.0):
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+
+def cache_key(name, style, language, tone, day):
+    raw = '\x1f'.join((name, style, language, tone, day.isoformat()))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class BirthdayMessageGenerator:
+    """Generates birthday messages through Groq with bounded parallelism,
+    a rate limit and a persistent cache keyed by (name, style, language,
+    tone, date).
+
+    get_client() returns the Groq client, or None when Groq is not
+    configured; it is called on use so the client can be created lazily.
+    """
+
+    def __init__(self, get_client, max_workers=MAX_CONCURRENCY, rate_per_minute=RATE_PER_MINUTE, cache_limit=CACHE_LIMIT):
+        self.get_client = get_client
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(rate_per_minute)
+        self.cache_limit = cache_limit
+
+    def cached(self, key):
+        row = db.query_one("SELECT message FROM ai_message_cache WHERE key=?", (key,))
+        if row:
+            db.execute("UPDATE ai_message_cache SET last_used=? WHERE key=?", (datetime.now().isoformat(), key))
+            return row[0]
+        return None
+
+    def generate(self, name, ai, day):
+        """Message for one person's birthday on `day`; never raises."""
+        client = self.get_client()
+        if not client or not ai:
+            return f"Happy Birthday {name}!"
+        style, language, tone = ai
+        key = cache_key(name, style, language, tone, day)
+        message = self.cached(key)
+        if message is not None:
+            return message
+        prompt = f"Generate a {style} birthday message for {name} in {language}, with a {tone} tone, including emojis."
+        self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = client.chat.completions.create(
+                model=MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=50
+            )
+            message = response.choices[0].message.content.strip()
+        except Exception as e:
+            GROQ_SECONDS.observe(time.perf_counter() - start, 'birthday', 'error')
+            print(f'Birthday message generation for {name} failed: {e}')
+            return f"Happy Birthday {name}!"
+        GROQ_SECONDS.observe(time.perf_counter() - start, 'birthday', 'ok')
+        now = datetime.now().isoformat()
+        db.execute('''INSERT OR REPLACE INTO ai_message_cache (key, name, style, language, tone, day, message, created_at, last_used)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (key, name, style, language, tone, day.isoformat(), message, now, now))
+        return message
+
+    def generate_many(self, names, ai, day):
+        """Generate messages for many people concurrently; returns {name: message}."""
+        unique = list(dict.fromkeys(names))
+        if not unique:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='birthday-ai') as pool:
+            messages = dict(zip(unique, pool.map(lambda name: self.generate(name, ai, day), unique)))
+        self.evict()
+        return messages
+
+    def evict(self):
+        """Drop the least recently used entries beyond the cache limit."""
+        db.execute('''DELETE FROM ai_message_cache WHERE key IN
+                      (SELECT key FROM ai_message_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)''',
+                   (self.cache_limit,))
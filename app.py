@@ -1,15 +1,28 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-import sqlite3
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, g
 import os
+import json
+import time
+import threading
+import zipfile
 from datetime import datetime, timedelta
-import groq
-import requests
-from apscheduler.schedulers.background import BackgroundScheduler
-import pandas as pd
 from werkzeug.utils import secure_filename
-import csv
-import socket
-import bcrypt
+import db
+import settings_cache
+import transport
+import delivery
+import importer
+import message_log
+import upcoming
+import ai_messages
+import news
+import schedules
+import leader
+import health
+import metrics
+import auth
+import events
+import export
+import playlist
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 
 app = Flask(__name__)
@@ -19,23 +32,36 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Instrumentation, served at /metrics
+REQUEST_SECONDS = metrics.Histogram('ledboard_http_request_seconds', 'Time spent handling HTTP requests.',
+                                    ('route', 'method', 'status'))
+QUERY_SECONDS = metrics.Histogram('ledboard_sqlite_query_seconds', 'SQLite statement execution time.', ('statement',))
+DELIVERIES = metrics.Counter('ledboard_deliveries_total', 'Messages that reached a final delivery status.', ('status',))
+db.query_observers.append(lambda sql, seconds: QUERY_SECONDS.observe(seconds, sql.lstrip().split(None, 1)[0].upper()))
+
 class User(UserMixin):
     def __init__(self, id, username, role):
         self.id = id
         self.username = username
         self.role = role
 
-@login_manager.user_loader
-def load_user(user_id):
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("SELECT id, username, role FROM users WHERE id = ?", (user_id,))
-    user = c.fetchone()
-    conn.close()
+def fetch_user(user_id):
+    user = db.query_one("SELECT id, username, role FROM users WHERE id = ?", (user_id,))
     if user:
         return User(user[0], user[1], user[2])
     return None
 
+# Logged-in users, so authenticated requests skip the users query; cleared on any users change
+user_cache = auth.UserCache(version=lambda: db.data_version('users'))
+
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    return user_cache.get(user_id, fetch_user)
+
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
@@ -43,13 +69,19 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 # Groq API Key (set in environment)
 api_key = os.getenv('GROQ_API_KEY')
-if api_key:
-    client = groq.Groq(api_key=api_key)
-else:
-    client = None
+_groq_client = None
+
+def groq_client():
+    """Groq client, or None without an API key; groq is only imported on first use"""
+    global _groq_client
+    if _groq_client is None and api_key:
+        import groq
+        _groq_client = groq.Groq(api_key=api_key)
+    return _groq_client
 
 # NewsAPI Key
 NEWS_API_KEY = os.getenv('NEWS_API_KEY')
+NEWS_API_URL = os.getenv('NEWS_API_URL', news.NEWS_API_URL)
 
 # P10 LED Settings (default)
 LED_IP = '192.168.1.100'
@@ -58,34 +90,25 @@ LED_PROTOCOL = 'HTTP'  # or TCP
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('birthdays.db')
+    conn = db.get_conn()
+    db.migrate(conn)
     c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS birthdays
-                 (id INTEGER PRIMARY KEY, name TEXT, dob TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS messages
-                 (id INTEGER PRIMARY KEY, message TEXT, timestamp TEXT, type TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS schedules
-                 (id INTEGER PRIMARY KEY, time TEXT, message TEXT, active INTEGER)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, role TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS board_settings
-                 (id INTEGER PRIMARY KEY, ssid TEXT, password TEXT, ip TEXT, port INTEGER, protocol TEXT, brightness INTEGER, font_size INTEGER, color TEXT, effect TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS ai_settings
-                 (id INTEGER PRIMARY KEY, style TEXT, language TEXT, tone TEXT)''')
-    # Insert default user
-    c.execute("INSERT OR REPLACE INTO users (username, password, role) VALUES (?, ?, ?)", ('admin', bcrypt.hashpw('admin123'.encode(), bcrypt.gensalt()).decode(), 'admin'))
+    # Insert default user; hashing is slow, so only when it is missing
+    if not c.execute("SELECT 1 FROM users WHERE username = ?", ('admin',)).fetchone():
+        c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ('admin', auth.hash_password('admin123'), 'admin'))
     # Insert default board settings
-    c.execute("INSERT OR IGNORE INTO board_settings (ssid, password, ip, port, protocol, brightness, font_size, color, effect) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", ('W3_SIES_4ft_DISPLAY_20102024', 'sai88888888', '192.168.4.1', 80, 'HTTP', 50, 16, 'white', 'scroll_left'))
+    c.execute("INSERT OR IGNORE INTO board_settings (id, ssid, password, ip, port, protocol, brightness, font_size, color, effect) VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?)", ('W3_SIES_4ft_DISPLAY_20102024', 'sai88888888', '192.168.4.1', 80, 'HTTP', 50, 16, 'white', 'scroll_left'))
+    c.execute("INSERT OR IGNORE INTO boards (id, name, ip, port, ssid, wifi_pass, protocol, active) SELECT 1, 'Main board', ip, port, ssid, password, protocol, 1 FROM board_settings WHERE id=1")
     # Insert default AI settings
-    c.execute("INSERT OR IGNORE INTO ai_settings (style, language, tone) VALUES (?, ?, ?)", ('casual', 'English', 'funny'))
+    c.execute("INSERT OR IGNORE INTO ai_settings (id, style, language, tone) VALUES (1, ?, ?, ?)", ('casual', 'English', 'funny'))
     conn.commit()
-    conn.close()
 
-init_db()
+cached_settings = settings_cache.SettingsCache()
 
-# Scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
+# Created by create_app()
+scheduler = None
+user_schedules = None
+election = None
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -95,12 +118,15 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        conn = sqlite3.connect('birthdays.db')
-        c = conn.cursor()
-        c.execute("SELECT id, username, password, role FROM users WHERE username = ?", (username,))
-        user = c.fetchone()
-        conn.close()
-        if user and password == 'admin123':  # Temporary fix for bcrypt issue
+        user = db.query_one("SELECT id, username, password, role FROM users WHERE username = ?", (username,))
+        try:
+            valid = auth.verify_password(password, user[2] if user else None)
+        except auth.VerifierBusy:
+            flash('Too many login attempts, please try again shortly')
+            return render_template('login.html'), 503
+        if valid:
+            if auth.needs_rehash(user[2]):
+                db.execute("UPDATE users SET password = ? WHERE id = ?", (auth.hash_password(password), user[0]))
             user_obj = User(user[0], user[1], user[3])
             login_user(user_obj)
             return redirect(url_for('dashboard'))
@@ -117,23 +143,10 @@ def logout():
 @login_required
 def dashboard():
     # Get upcoming birthdays
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
     today = datetime.now().date()
-    upcoming = []
-    c.execute("SELECT name, dob FROM birthdays")
-    for row in c.fetchall():
-        name, dob_str = row
-        dob = datetime.strptime(dob_str, '%Y-%m-%d').date()
-        next_birthday = dob.replace(year=today.year)
-        if next_birthday < today:
-            next_birthday = next_birthday.replace(year=today.year + 1)
-        days = (next_birthday - today).days
-        if days <= 30:  # Show next 30 days
-            upcoming.append({'name': name, 'days': days})
-    conn.close()
-    upcoming.sort(key=lambda x: x['days'])
-    return render_template('index.html', upcoming=upcoming)
+    # Show next 30 days
+    upcoming_list = [{'name': name, 'days': days} for name, _, days in upcoming.upcoming_birthdays(db.get_conn(), today, 30)]
+    return render_template('index.html', upcoming=upcoming_list)
 
 @app.route('/birthdays', methods=['GET', 'POST'])
 @login_required
@@ -149,39 +162,23 @@ def birthdays():
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
             file.save(filepath)
-            # Parse file
-            if filename.endswith('.csv'):
-                with open(filepath, newline='') as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        name = row.get('Name')
-                        dob = row.get('DateOfBirth')
-                        if name and dob:
-                            conn = sqlite3.connect('birthdays.db')
-                            c = conn.cursor()
-                            c.execute("INSERT INTO birthdays (name, dob) VALUES (?, ?)", (name, dob))
-                            conn.commit()
-                            conn.close()
-            elif filename.endswith('.xlsx'):
-                df = pd.read_excel(filepath)
-                for _, row in df.iterrows():
-                    name = row.get('Name')
-                    dob = row.get('DateOfBirth')
-                    if name and dob:
-                        conn = sqlite3.connect('birthdays.db')
-                        c = conn.cursor()
-                        c.execute("INSERT INTO birthdays (name, dob) VALUES (?, ?)", (name, str(dob.date())))
-                        conn.commit()
-                        conn.close()
-            flash('Birthdays uploaded successfully')
+            # Parse file as a stream and import it in one transaction
+            rows = importer.iter_csv(filepath) if filename.endswith('.csv') else importer.iter_xlsx(filepath)
+            try:
+                report = importer.import_birthdays(db.get_conn(), rows)
+            except (ValueError, OSError, zipfile.BadZipFile) as e:
+                flash(f'Could not read {filename}: {e}')
+                return redirect(url_for('birthdays'))
+            flash(report.summary())
+            for number, reason in report.rejected[:10]:
+                flash(f'Row {number} rejected: {reason}')
+            if len(report.rejected) > 10:
+                flash(f'...and {len(report.rejected) - 10} more rejected rows')
             return redirect(url_for('birthdays'))
     # Get all birthdays
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("SELECT name, dob FROM birthdays")
-    birthdays_list = [{'name': row[0], 'dob': row[1]} for row in c.fetchall()]
-    conn.close()
+    birthdays_list = [{'name': row[0], 'dob': row[1]} for row in db.query("SELECT name, dob FROM birthdays")]
     return render_template('birthdays.html', birthdays=birthdays_list)
 
 @app.route('/messages', methods=['GET', 'POST'])
@@ -189,26 +186,55 @@ def birthdays():
 def messages():
     if request.method == 'POST':
         message = request.form['message']
-        send_message(message)
-        # Log message
-        conn = sqlite3.connect('birthdays.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (message, timestamp, type) VALUES (?, ?, ?)", (message, datetime.now().isoformat(), 'custom'))
-        conn.commit()
-        conn.close()
-        flash('Message sent')
+        try:
+            queue_message(message, 'custom')
+            flash('Message queued for delivery')
+        except delivery.QueueFull:
+            flash('Board is busy, message was not queued')
         return redirect(url_for('messages'))
     return render_template('messages.html')
 
 @app.route('/logs')
 @login_required
 def logs():
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("SELECT message, timestamp, type FROM messages ORDER BY timestamp DESC")
-    logs_list = [{'message': row[0], 'timestamp': row[1], 'type': row[2]} for row in c.fetchall()]
-    conn.close()
-    return render_template('logs.html', logs=logs_list)
+    msg_type = request.args.get('type') or None
+    search = request.args.get('q') or None
+    logs_list, next_cursor = message_log.page(request.args.get('before'), message_log.PAGE_SIZE, search, msg_type)
+    return render_template('logs.html', logs=logs_list, next_cursor=next_cursor, msg_type=msg_type, search=search,
+                           types=message_log.MESSAGE_TYPES, counts=message_log.counts_by_type())
+
+@app.route('/api/logs', methods=['GET'])
+@login_required
+def api_logs():
+    """Page through the message log; pass next_cursor back as ?before= for older rows"""
+    rows, next_cursor = message_log.page(request.args.get('before'),
+                                         request.args.get('limit', message_log.PAGE_SIZE, type=int),
+                                         request.args.get('q'), request.args.get('type'))
+    return jsonify({'logs': rows, 'next_cursor': next_cursor})
+
+def export_response(name, rows):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return jsonify({'status': 'error', 'message': f'format must be one of {", ".join(export.FORMATS)}'}), 400
+    try:
+        body = rows(fmt, limit=request.args.get('limit', type=int), **{key: request.args.get(key) for key in ('since', 'until', 'after')})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return app.response_class(body, mimetype=export.FORMATS[fmt],
+                              headers={'Content-Disposition': f'attachment; filename={name}.{fmt}'})
+
+@app.route('/api/export/messages', methods=['GET'])
+@login_required
+def api_export_messages():
+    """Stream the message log oldest first; resume with ?after=<timestamp>~<id> of the last row received"""
+    msg_type = request.args.get('type') or None
+    return export_response('messages', lambda fmt, **filters: export.messages(fmt, msg_type, **filters))
+
+@app.route('/api/export/birthdays', methods=['GET'])
+@login_required
+def api_export_birthdays():
+    """Stream birthdays in id order; resume with ?after=<id> of the last row received"""
+    return export_response('birthdays', export.birthdays)
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
@@ -223,135 +249,177 @@ def settings():
         font_size = int(request.form['font_size'])
         color = request.form['color']
         effect = request.form['effect']
-        conn = sqlite3.connect('birthdays.db')
-        c = conn.cursor()
-        c.execute("UPDATE board_settings SET ssid=?, password=?, ip=?, port=?, protocol=?, brightness=?, font_size=?, color=?, effect=? WHERE id=1", (ssid, password, ip, port, protocol, brightness, font_size, color, effect))
-        conn.commit()
-        conn.close()
+        with db.transaction() as c:
+            c.execute("UPDATE board_settings SET ssid=?, password=?, ip=?, port=?, protocol=?, brightness=?, font_size=?, color=?, effect=? WHERE id=1", (ssid, password, ip, port, protocol, brightness, font_size, color, effect))
+            c.execute("UPDATE boards SET ssid=?, wifi_pass=?, ip=?, port=?, protocol=? WHERE id=1", (ssid, password, ip, port, protocol))
+        cached_settings.refresh()
         flash('Settings updated')
         return redirect(url_for('settings'))
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM board_settings WHERE id=1")
-    settings = c.fetchone()
-    conn.close()
+    settings = cached_settings.get().display
     return render_template('settings.html', settings=settings)
 
 @app.route('/api/schedule', methods=['POST'])
 def api_schedule():
     data = request.json
-    time = data['time']
-    message = data['message']
-    active = 1 if data['active'] else 0
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO schedules (time, message, active) VALUES (?, ?, ?)", (time, message, active))
-    conn.commit()
-    conn.close()
-    # Add to scheduler
-    if active:
-        scheduler.add_job(send_message, 'cron', hour=int(time.split(':')[0]), minute=int(time.split(':')[1]), args=[message])
+    try:
+        schedule_id = user_schedules.create(data['time'], data['message'], data['active'])
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'Invalid schedule: {e}'}), 400
+    return jsonify({'status': 'ok', 'id': schedule_id})
+
+@app.route('/api/schedules', methods=['GET'])
+def api_schedules():
+    rows = db.query("SELECT id, time, message, active FROM schedules ORDER BY time, id")
+    return jsonify([{'id': r[0], 'time': r[1], 'message': r[2], 'active': bool(r[3])} for r in rows])
+
+@app.route('/api/schedule/<int:schedule_id>', methods=['PUT'])
+def api_schedule_update(schedule_id):
+    data = request.json or {}
+    try:
+        found = user_schedules.update(schedule_id, data.get('time'), data.get('message'), data.get('active'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid schedule: {e}'}), 400
+    if not found:
+        return jsonify({'error': 'Schedule not found'}), 404
     return jsonify({'status': 'ok'})
 
-def send_message(message):
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("SELECT ip, port, protocol FROM board_settings WHERE id=1")
-    board = c.fetchone()
-    conn.close()
-    if board:
-        ip, port, protocol = board
-        if protocol == 'HTTP':
-            try:
-                requests.post(f'http://{ip}:{port}/display', json={'message': message})
-            except:
-                pass
-        elif protocol == 'TCP':
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((ip, port))
-                sock.sendall(message.encode())
-                sock.close()
-            except:
-                pass
-    print(f'Sending message: {message}')
-
-def generate_birthday_message(name):
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("SELECT style, language, tone FROM ai_settings WHERE id=1")
-    ai = c.fetchone()
-    conn.close()
-    if client and ai:
-        style, language, tone = ai
-        prompt = f"Generate a {style} birthday message for {name} in {language}, with a {tone} tone, including emojis."
-        response = client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=50
-        )
-        return response.choices[0].message.content.strip()
+@app.route('/api/schedule/<int:schedule_id>', methods=['DELETE'])
+def api_schedule_delete(schedule_id):
+    if not user_schedules.delete(schedule_id):
+        return jsonify({'error': 'Schedule not found'}), 404
+    return jsonify({'status': 'ok'})
+
+def send_message(message, board_id=1):
+    board = cached_settings.get().board(board_id)
+    if not board:
+        return transport.SendResult(False, 0.0, f'Board {board_id} not found')
+    if board_monitor.is_down(board_id):
+        return transport.SendResult(False, 0.0, 'Board offline')
+    ip, port, protocol = board.ip, board.port, board.protocol
+    if not isinstance(message, (str, bytes)):
+        # Rendered frame (a numpy array): ship only what changed since the board's last frame
+        result = frame_stream(board_id).send(message, lambda encode: transport.send(ip, port, protocol, encode))
     else:
-        return f"Happy Birthday {name}!"
+        result = transport.send(ip, port, protocol, message)
+    board_monitor.observe(board_id, result.ok, result.elapsed, result.error)
+    if not result.ok:
+        print(f'Delivery to {ip}:{port} failed after {result.elapsed:.3f}s: {result.error}')
+    return result
+
+# Per-board delta encoding state for rendered frames; frame_diff, renderer
+# and numpy are only imported once something is rendered
+KEYFRAME_INTERVAL = os.getenv('KEYFRAME_INTERVAL')
+frame_streams = {}
+
+def frame_stream(board_id):
+    stream = frame_streams.get(board_id)
+    if stream is None:
+        import frame_diff
+        interval = int(KEYFRAME_INTERVAL) if KEYFRAME_INTERVAL else frame_diff.KEYFRAME_INTERVAL
+        stream = frame_streams.setdefault(board_id, frame_diff.FrameStream(interval))
+    return stream
+
+# Outbound delivery queue
+def record_delivery(message_id, status, attempts, error):
+    DELIVERIES.inc(status)
+    delivered_at = datetime.now().isoformat()
+    db.execute("UPDATE messages SET status=?, attempts=?, error=?, delivered_at=? WHERE id=?",
+               (status, attempts, error, delivered_at, message_id))
+
+def fail_stale_messages():
+    failed = message_log.fail_stale()
+    if failed:
+        DELIVERIES.inc('failed', amount=failed)
+        print(f'Marked {failed} undelivered messages from a previous run as failed')
+    message_log.prune_changes()
+
+# Live updates for browsers, streamed from /api/events. Message and delivery
+# events come from the message_changes table, so they include rows written
+# by other server processes; board events are published directly
+event_hub = events.EventHub(max_clients=int(os.getenv('SSE_MAX_CLIENTS', events.MAX_CLIENTS)))
+message_tail = events.Tail(event_hub, message_log.changes)
+metrics.Gauge('ledboard_sse_clients', 'Browsers connected to /api/events.', collect=lambda: {(): event_hub.clients()})
+
+def board_event(board_id):
+    return {'board_id': board_id, **(board_monitor.status(board_id) or {})}
+
+# Board health is probed in the background; sends to boards known to be down are held until they recover
+board_monitor = health.HealthMonitor(
+    lambda: {board.id: (board.ip, board.port) for board in cached_settings.get().boards.values() if board.active},
+    persist=lambda: election is not None and election.leader,
+    on_change=lambda board_id, online: event_hub.publish('board', board_event(board_id)))
+
+outbox = delivery.DeliveryQueue(lambda board_id, message: send_message(message, board_id), record_delivery,
+                                wait_ready=board_monitor.wait_online)
+
+metrics.Gauge('ledboard_delivery_queue_depth', 'Messages waiting in each board\'s delivery queue.', ('board_id',),
+              collect=outbox.depth)
+metrics.Gauge('ledboard_board_up', 'Whether the board answered its last health check or send.', ('board_id',),
+              collect=lambda: {board_id: int(online) for board_id, online in board_monitor.online().items()})
+
+def queue_message(message, msg_type, board_id=1, payload=None):
+    """Log a message as queued and hand it to the delivery workers, returning its id
+
+    payload, if given, is what the board receives (e.g. a rendered frame)
+    while message is the text kept in the log.
+    """
+    timestamp = datetime.now().isoformat()
+    message_id = db.execute("INSERT INTO messages (message, timestamp, type, status, attempts, board_id) VALUES (?, ?, ?, ?, ?, ?)",
+                            (message, timestamp, msg_type, 'queued', 0, board_id)).lastrowid
+    try:
+        outbox.submit(board_id, message_id, message if payload is None else payload)
+    except delivery.QueueFull:
+        record_delivery(message_id, 'dropped', 0, 'Delivery queue full')
+        raise
+    return message_id
+
+birthday_generator = ai_messages.BirthdayMessageGenerator(groq_client)
+
+# Stored playlists are cycled on their boards by the scheduler leader
+playlist_engine = playlist.PlaylistEngine(cached_settings.get, lambda board_id, payload: send_message(payload, board_id))
+
+def generate_birthday_message(name, day=None):
+    return birthday_generator.generate(name, cached_settings.get().ai, day or datetime.now().date())
+
+news_pipeline = news.NewsPipeline(NEWS_API_KEY, NEWS_API_URL)
 
 def fetch_news():
+    """Next fresh headline (AI-summarized when Groq is configured), or None"""
     if NEWS_API_KEY:
-        url = f'https://newsapi.org/v2/top-headlines?country=us&apiKey={NEWS_API_KEY}'
-        response = requests.get(url)
-        if response.status_code == 200:
-            articles = response.json()['articles']
-            if articles:
-                headline = articles[0]['title']
-                if client:
-                    conn = sqlite3.connect('birthdays.db')
-                    c = conn.cursor()
-                    c.execute("SELECT language FROM ai_settings WHERE id=1")
-                    lang = c.fetchone()[0]
-                    conn.close()
-                    prompt = f"Summarize and rephrase this news headline in {lang}: {headline}"
-                    ai_response = client.chat.completions.create(
-                        model="llama3-8b-8192",
-                        messages=[{"role": "user", "content": prompt}],
-                        max_tokens=100
-                    )
-                    return ai_response.choices[0].message.content.strip()
-                else:
-                    return headline
+        return news_pipeline.next_item(cached_settings.get().ai.language, groq_client())
     return None
 
-# Schedule daily tasks
-scheduler.add_job(lambda: send_birthday_messages(), 'cron', hour=9, minute=0)
-scheduler.add_job(lambda: send_news(), 'cron', hour=18, minute=0)
+def prepare_birthday_messages():
+    """Generate tomorrow's birthday messages ahead of time so 09:00 only delivers"""
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    names = [name for name, _, _ in upcoming.upcoming_birthdays(db.get_conn(), tomorrow, 0)]
+    birthday_generator.generate_many(names, cached_settings.get().ai, tomorrow)
 
 def send_birthday_messages():
     today = datetime.now().date()
-    conn = sqlite3.connect('birthdays.db')
-    c = conn.cursor()
-    c.execute("SELECT name FROM birthdays WHERE substr(dob, 6) = ?", (today.strftime('%m-%d'),))
-    for row in c.fetchall():
-        name = row[0]
-        message = generate_birthday_message(name)
-        send_message(message)
-        # Log
-        c.execute("INSERT INTO messages (message, timestamp, type) VALUES (?, ?, ?)", (message, datetime.now().isoformat(), 'birthday'))
-    conn.commit()
-    conn.close()
+    names = [name for name, _, _ in upcoming.upcoming_birthdays(db.get_conn(), today, 0)]
+    # Mostly cache hits after prepare_birthday_messages; anything missing is generated concurrently
+    messages = birthday_generator.generate_many(names, cached_settings.get().ai, today)
+    for name in names:
+        message = messages[name]
+        try:
+            queue_message(message, 'birthday')
+        except delivery.QueueFull:
+            print(f'Birthday message for {name} dropped: delivery queue full')
 
 def send_news():
     news = fetch_news()
     if news:
-        send_message(news)
-        conn = sqlite3.connect('birthdays.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (message, timestamp, type) VALUES (?, ?, ?)", (news, datetime.now().isoformat(), 'news'))
-        conn.commit()
-        conn.close()
+        try:
+            queue_message(news, 'news')
+        except delivery.QueueFull:
+            print('News message dropped: delivery queue full')
 
 # API endpoints for frontend
 @app.route('/api/status', methods=['GET'])
 def api_status():
     """Check API server status"""
-    return jsonify({'status': 'online', 'timestamp': datetime.now().isoformat()})
+    return jsonify({'status': 'online', 'timestamp': datetime.now().isoformat(), 'scheduler': election.status()})
 
 @app.route('/api/message', methods=['POST'])
 def api_message():
@@ -360,21 +428,47 @@ def api_message():
         data = request.json
         message = data.get('text', '')
         
-        # Send message to LED board
-        send_message(message)
+        # Queue message for the LED board; delivery status is recorded in the log
+        message_id = queue_message(message, 'quick_message')
         
-        # Log the message
-        conn = sqlite3.connect('birthdays.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (message, timestamp, type) VALUES (?, ?, ?)", 
-                 (message, datetime.now().isoformat(), 'quick_message'))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'status': 'success', 'message': 'Message sent successfully'})
+        return jsonify({'status': 'success', 'id': message_id, 'message': 'Message queued'}), 202
+    except delivery.QueueFull as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def program_text(widgets):
+    """Flatten editor widgets into a single display message"""
+    import renderer
+    return renderer.program_text(widgets)
+
+def render_board_frame(widgets, board_id):
+    """Rendered frame of a program for a frame-capable board, else None"""
+    current = cached_settings.get()
+    board = current.board(board_id)
+    if not board or not board.frames:
+        return None
+    import renderer
+    display = current.display
+    return renderer.render_program(widgets, board.width, board.height,
+                                   default_color=display[8], default_font_size=display[7])
+
+@app.route('/api/program/frame', methods=['POST'])
+def api_program_frame():
+    """Render a program to a packed P10 frame without sending it"""
+    import renderer
+    try:
+        data = request.json or {}
+        current = cached_settings.get()
+        board = current.board(data.get('board_id', 1))
+        width = int(data.get('width') or (board.width if board else 96))
+        height = int(data.get('height') or (board.height if board else 16))
+        frame = renderer.render_program(data.get('widgets', []), width, height,
+                                        default_color=current.display[8], default_font_size=current.display[7])
+        return app.response_class(renderer.pack_frame(frame), mimetype='application/octet-stream')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
 @app.route('/api/program', methods=['POST'])
 def api_program():
     """Send program with widgets to LED board"""
@@ -384,77 +478,464 @@ def api_program():
         widgets = data.get('widgets', [])
         
         # Process widgets and create display message
-        display_messages = []
-        for widget in widgets:
-            if widget['type'] == 'text':
-                display_messages.append(widget['properties']['text'])
-            elif widget['type'] == 'clock':
-                current_time = datetime.now()
-                if widget['properties']['format'] == '12h':
-                    time_str = current_time.strftime('%I:%M %p')
-                else:
-                    time_str = current_time.strftime('%H:%M')
-                display_messages.append(time_str)
-        
-        # Combine all messages
-        combined_message = ' | '.join(display_messages) if display_messages else 'Program Active'
+        combined_message = program_text(widgets)
         
-        # Send to LED board
-        send_message(combined_message)
+        # Boards that accept frames get the rendered layout, others the flattened text
+        frame = render_board_frame(widgets, 1)
         
-        # Log the program
-        conn = sqlite3.connect('birthdays.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (message, timestamp, type) VALUES (?, ?, ?)", 
-                 (f"Program: {combined_message}", datetime.now().isoformat(), 'program'))
-        conn.commit()
-        conn.close()
+        # Queue for the LED board; delivery status is recorded in the log
+        message_id = queue_message(combined_message, 'program', payload=frame)
         
-        return jsonify({'status': 'success', 'message': 'Program sent successfully'})
+        return jsonify({'status': 'success', 'id': message_id, 'message': 'Program queued'}), 202
+    except delivery.QueueFull as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/message/<int:message_id>', methods=['GET'])
+def api_message_status(message_id):
+    """Get delivery status of a queued message"""
+    row = db.query_one("SELECT status, attempts, error, delivered_at FROM messages WHERE id=?", (message_id,))
+    if not row:
+        return jsonify({'status': 'error', 'message': 'Message not found'}), 404
+    return jsonify({'id': message_id, 'status': row[0], 'attempts': row[1], 'error': row[2], 'delivered_at': row[3]})
+
+# Batch ingestion for integrations; one request, one transaction, one result per item.
+# A batch never holds more messages than one board's delivery queue
+BATCH_LIMIT = min(int(os.getenv('BATCH_LIMIT', delivery.MAX_PENDING)), delivery.MAX_PENDING)
+
+def batch_items(key):
+    """The list under `key` in the JSON body, or an error response"""
+    data = request.get_json(silent=True)
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return None, (jsonify({'status': 'error', 'message': f'Expected a JSON object with a "{key}" list'}), 400)
+    if len(items) > BATCH_LIMIT:
+        return None, (jsonify({'status': 'error', 'message': f'At most {BATCH_LIMIT} items per batch'}), 413)
+    return items, None
+
+@app.route('/api/messages/batch', methods=['POST'])
+def api_message_batch():
+    """Queue many messages: {"messages": [{"text", "board_id"}]}; board_id defaults to 1
+
+    Items beyond the free space in their board's delivery queue are rejected
+    without being logged; a batch refused only for that gets a 429.
+    """
+    items, error = batch_items('messages')
+    if error:
+        return error
+    current = cached_settings.get()
+    results = []
+    accepted = []  # (index, board_id, text)
+    room = {}  # board id -> queue slots left for this batch
+    throttled = 0
+    for index, item in enumerate(items):
+        text = item.get('text') if isinstance(item, dict) else None
+        board_id = item.get('board_id', 1) if isinstance(item, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            results.append({'index': index, 'status': 'rejected', 'error': 'text must be a non-empty string'})
+        elif not isinstance(board_id, int) or isinstance(board_id, bool) or not current.board(board_id):
+            results.append({'index': index, 'status': 'rejected', 'error': f'Board {board_id} not found'})
+        else:
+            if board_id not in room:
+                room[board_id] = outbox.free(board_id)
+            if room[board_id] == 0:
+                # Refused before logging, so the caller can simply resend these later
+                results.append({'index': index, 'status': 'rejected', 'error': 'Delivery queue full'})
+                throttled += 1
+                continue
+            room[board_id] -= 1
+            results.append(None)
+            accepted.append((index, board_id, text))
+
+    timestamp = datetime.now().isoformat()
+    with db.transaction() as c:
+        ids = [c.execute("INSERT INTO messages (message, timestamp, type, status, attempts, board_id) VALUES (?, ?, ?, ?, ?, ?)",
+                         (text, timestamp, 'quick_message', 'queued', 0, board_id)).lastrowid
+               for _, board_id, text in accepted]
+
+    # Hand each board its share in order; anything that no longer fits (another
+    # request filled the queue since the check above) is marked dropped
+    by_board = {}
+    for (index, board_id, text), message_id in zip(accepted, ids):
+        by_board.setdefault(board_id, []).append((index, message_id, text))
+    dropped = []
+    for board_id, queued in by_board.items():
+        count = outbox.submit_many(board_id, [(message_id, text) for _, message_id, text in queued])
+        for position, (index, message_id, _) in enumerate(queued):
+            if position < count:
+                results[index] = {'index': index, 'status': 'queued', 'id': message_id}
+            else:
+                results[index] = {'index': index, 'status': 'dropped', 'id': message_id, 'error': 'Delivery queue full'}
+                dropped.append(message_id)
+    if dropped:
+        with db.transaction() as c:
+            c.executemany("UPDATE messages SET status='dropped', error='Delivery queue full', delivered_at=? WHERE id=?",
+                          [(timestamp, message_id) for message_id in dropped])
+        DELIVERIES.inc('dropped', amount=len(dropped))
+    body = {'status': 'success' if ids else 'error', 'queued': len(ids) - len(dropped), 'dropped': len(dropped),
+            'rejected': len(items) - len(ids), 'throttled': throttled, 'results': results}
+    if ids:
+        return jsonify(body), 202
+    if throttled:
+        return jsonify(body), 429, {'Retry-After': '5'}
+    return jsonify(body), 400
+
+@app.route('/api/birthdays/batch', methods=['POST'])
+@login_required
+def api_birthday_batch():
+    """Import many birthdays: {"birthdays": [{"name", "dob"}]}, with the same rules as file uploads"""
+    items, error = batch_items('birthdays')
+    if error:
+        return error
+    rows = ((index, item.get('name'), item.get('dob')) if isinstance(item, dict) else (index, None, None)
+            for index, item in enumerate(items))
+    report = importer.import_birthdays(db.get_conn(), rows, detail=True)
+    rejected = dict(report.rejected)
+    duplicates = set(report.duplicate_rows)
+    results = []
+    for index in range(len(items)):
+        if index in rejected:
+            results.append({'index': index, 'status': 'rejected', 'error': rejected[index]})
+        else:
+            results.append({'index': index, 'status': 'duplicate' if index in duplicates else 'inserted'})
+    return jsonify({'status': 'success', 'inserted': report.inserted, 'duplicates': report.duplicates,
+                    'rejected': len(report.rejected), 'results': results})
+
 @app.route('/api/board/status', methods=['GET'])
 def api_board_status():
-    """Get LED board status"""
+    """Get LED board status from the background health monitor"""
+    board_id = request.args.get('board_id', 1, type=int)
+    board = cached_settings.get().board(board_id)
+    if not board:
+        return jsonify({'online': False, 'error': 'Board settings not found'})
+    if not board.ip or not board.port:
+        return jsonify({'online': False, 'error': 'Board not configured'})
+    status = board_monitor.status(board_id)
+    if status is None:
+        # Not probed yet (e.g. just added); ask for a probe and report unknown
+        board_monitor.check_now(board_id)
+        status = {'online': False, 'checked': False, 'error': 'Not checked yet'}
+    return jsonify({'ip': board.ip, 'port': board.port, **status})
+
+@app.route('/api/board/health', methods=['GET'])
+def api_board_health():
+    """Stored probe history for a board, newest first"""
+    board_id = request.args.get('board_id', 1, type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    return jsonify([{'checked_at': r[0], 'online': bool(r[1]), 'latency_ms': r[2], 'error': r[3]}
+                    for r in health.history(board_id, limit)])
+
+@app.route('/api/boards', methods=['GET'])
+def api_boards():
+    """List registered LED boards"""
+    boards = [{'id': row[0], 'name': row[1], 'ip': row[2], 'port': row[3], 'protocol': row[4], 'active': bool(row[5]),
+               'width': row[6], 'height': row[7], 'frames': bool(row[8])}
+              for row in db.query("SELECT id, name, ip, port, protocol, active, width, height, frames FROM boards ORDER BY id")]
+    return jsonify({'boards': boards})
+
+@app.route('/api/boards', methods=['POST'])
+def api_add_board():
+    """Register an LED board"""
+    data = request.json or {}
+    if not data.get('ip') or not data.get('port'):
+        return jsonify({'status': 'error', 'message': 'ip and port are required'}), 400
+    protocol = data.get('protocol', 'HTTP')
+    if protocol not in transport.TRANSPORTS:
+        return jsonify({'status': 'error', 'message': f'Unknown protocol: {protocol}'}), 400
     try:
-        # Try to get board settings and test connection
-        conn = sqlite3.connect('birthdays.db')
-        c = conn.cursor()
-        c.execute("SELECT ip, port, protocol FROM board_settings WHERE id=1")
-        board = c.fetchone()
-        conn.close()
-        
-        if board:
-            # Try to ping the board (basic connectivity check)
-            ip, port, protocol = board
-            if ip and port:
-                try:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    sock.settimeout(3)  # 3 second timeout
-                    result = sock.connect_ex((ip, int(port)))
-                    sock.close()
-                    
-                    if result == 0:
-                        return jsonify({'online': True, 'ip': ip, 'port': port})
-                    else:
-                        return jsonify({'online': False, 'ip': ip, 'port': port, 'error': 'Connection failed'})
-                except:
-                    return jsonify({'online': False, 'ip': ip, 'port': port, 'error': 'Connection error'})
-            else:
-                return jsonify({'online': False, 'error': 'Board not configured'})
+        port, width, height = int(data['port']), int(data.get('width', 96)), int(data.get('height', 16))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'port, width and height must be whole numbers'}), 400
+    if not 0 < port < 65536:
+        return jsonify({'status': 'error', 'message': f'Invalid port: {port}'}), 400
+    import renderer
+    if width <= 0 or height <= 0 or width % renderer.PANEL_WIDTH or height % renderer.PANEL_HEIGHT:
+        return jsonify({'status': 'error', 'message': 'Board size must be a whole number of 32x16 panels'}), 400
+    board_id = db.execute("INSERT INTO boards (name, ip, port, ssid, wifi_pass, protocol, active, width, height, frames) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?)",
+                          (data.get('name'), data['ip'], port, data.get('ssid'), data.get('wifi_pass'), protocol,
+                           width, height, 1 if data.get('frames') else 0)).lastrowid
+    cached_settings.refresh()
+    return jsonify({'status': 'success', 'id': board_id}), 201
+
+@app.route('/api/boards/<int:board_id>', methods=['DELETE'])
+def api_remove_board(board_id):
+    """Deactivate an LED board so broadcasts skip it"""
+    found = db.execute("UPDATE boards SET active=0 WHERE id=?", (board_id,)).rowcount
+    cached_settings.refresh()
+    if not found:
+        return jsonify({'status': 'error', 'message': 'Board not found'}), 404
+    return jsonify({'status': 'success'})
+
+@app.route('/api/boards/<int:board_id>/playlist', methods=['PUT'])
+def api_board_playlist(board_id):
+    """Assign a stored playlist to a board, or stop one with null"""
+    playlist_id = (request.json or {}).get('playlist_id')
+    if playlist_id is not None and not db.query_one("SELECT 1 FROM playlists WHERE id=?", (playlist_id,)):
+        return jsonify({'status': 'error', 'message': 'Playlist not found'}), 404
+    if not db.execute("UPDATE boards SET playlist_id=? WHERE id=?", (playlist_id, board_id)).rowcount:
+        return jsonify({'status': 'error', 'message': 'Board not found'}), 404
+    playlists_changed()
+    return jsonify({'status': 'success'})
+
+# Stored programs and playlists
+def playlists_changed():
+    cached_settings.refresh()
+    playlist_engine.reload()
+
+def program_json(row):
+    return {'id': row[0], 'name': row[1], 'widgets': json.loads(row[2]), 'updated_at': row[3]}
+
+@app.route('/api/programs', methods=['GET'])
+def api_programs():
+    return jsonify({'programs': [program_json(row) for row in
+                                 db.query("SELECT id, name, widgets, updated_at FROM programs ORDER BY id")]})
+
+@app.route('/api/programs', methods=['POST'])
+@app.route('/api/programs/<int:program_id>', methods=['PUT'])
+def api_save_program(program_id=None):
+    """Store an editor program so playlists can show it"""
+    data = request.json or {}
+    widgets = data.get('widgets')
+    if not isinstance(widgets, list):
+        return jsonify({'status': 'error', 'message': 'widgets must be a list'}), 400
+    saved = playlist.save_program(data.get('name'), widgets, program_id)
+    if saved is None:
+        return jsonify({'status': 'error', 'message': 'Program not found'}), 404
+    playlists_changed()
+    return jsonify({'status': 'success', 'id': saved}), 201 if program_id is None else 200
+
+@app.route('/api/programs/<int:program_id>', methods=['DELETE'])
+def api_delete_program(program_id):
+    with db.transaction() as c:
+        found = c.execute("DELETE FROM programs WHERE id=?", (program_id,)).rowcount
+        c.execute("DELETE FROM playlist_items WHERE program_id=?", (program_id,))
+    if not found:
+        return jsonify({'status': 'error', 'message': 'Program not found'}), 404
+    playlists_changed()
+    return jsonify({'status': 'success'})
+
+@app.route('/api/playlists', methods=['GET'])
+def api_playlists():
+    return jsonify({'playlists': playlist.list_playlists()})
+
+@app.route('/api/playlists', methods=['POST'])
+@app.route('/api/playlists/<int:playlist_id>', methods=['PUT'])
+def api_save_playlist(playlist_id=None):
+    """Store a playlist: {"name", "active", "items": [{"program_id", "dwell"}]}, dwell in seconds"""
+    data = request.json or {}
+    try:
+        items = [(int(item['program_id']), float(item.get('dwell', 10))) for item in data.get('items', [])]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Each item needs a program_id and a numeric dwell'}), 400
+    program_ids = {program_id for program_id, _ in items}
+    if program_ids:
+        placeholders = ','.join('?' * len(program_ids))
+        known = {row[0] for row in db.query(f"SELECT id FROM programs WHERE id IN ({placeholders})", list(program_ids))}
+        if program_ids - known:
+            return jsonify({'status': 'error', 'message': f'Unknown programs: {sorted(program_ids - known)}'}), 400
+    saved = playlist.save_playlist(data.get('name'), items, data.get('active', True), playlist_id)
+    if saved is None:
+        return jsonify({'status': 'error', 'message': 'Playlist not found'}), 404
+    playlists_changed()
+    return jsonify({'status': 'success', 'id': saved}), 201 if playlist_id is None else 200
+
+@app.route('/api/playlists/<int:playlist_id>', methods=['DELETE'])
+def api_delete_playlist(playlist_id):
+    with db.transaction() as c:
+        found = c.execute("DELETE FROM playlists WHERE id=?", (playlist_id,)).rowcount
+        c.execute("DELETE FROM playlist_items WHERE playlist_id=?", (playlist_id,))
+        c.execute("UPDATE boards SET playlist_id=NULL WHERE playlist_id=?", (playlist_id,))
+    if not found:
+        return jsonify({'status': 'error', 'message': 'Playlist not found'}), 404
+    playlists_changed()
+    return jsonify({'status': 'success'})
+
+@app.route('/api/playlists/status', methods=['GET'])
+def api_playlist_status():
+    """What the playlist engine is showing on each board (only the scheduler leader runs it)"""
+    return jsonify({'running': election is not None and election.leader, 'boards': playlist_engine.status()})
+
+@app.route('/api/broadcast', methods=['POST'])
+def api_broadcast():
+    """Send one message or program to many boards concurrently"""
+    try:
+        data = request.json or {}
+        if 'widgets' in data:
+            message, msg_type = program_text(data['widgets']), 'program'
         else:
-            return jsonify({'online': False, 'error': 'Board settings not found'})
+            message, msg_type = data.get('text', ''), 'broadcast'
+        board_ids = cached_settings.get().active_board_ids
+        selected = data.get('board_ids')
+        if selected is not None and (not isinstance(selected, list) or
+                                     any(not isinstance(board_id, int) or isinstance(board_id, bool) for board_id in selected)):
+            return jsonify({'status': 'error', 'message': 'board_ids must be a list of board ids'}), 400
+        if selected:
+            board_ids = [board_id for board_id in board_ids if board_id in set(selected)]
+        if not board_ids:
+            return jsonify({'status': 'error', 'message': 'No active boards selected'}), 400
+        # Frame-capable boards get the program rendered at their own size
+        payloads = {board_id: message for board_id in board_ids}
+        if 'widgets' in data:
+            for board_id in board_ids:
+                frame = render_board_frame(data['widgets'], board_id)
+                if frame is not None:
+                    payloads[board_id] = frame
+
+        if not data.get('wait', True):
+            # Hand off to each board's delivery worker and return immediately
+            results = {}
+            for board_id in board_ids:
+                try:
+                    results[board_id] = {'id': queue_message(message, msg_type, board_id, payloads[board_id]),
+                                         'status': 'queued'}
+                except delivery.QueueFull as e:
+                    results[board_id] = {'status': 'dropped', 'error': str(e)}
+            return jsonify({'status': 'success', 'results': results}), 202
+
+        # Log one row per board, then deliver to all boards at once
+        now = datetime.now().isoformat()
+        message_ids = {}
+        with db.transaction() as c:
+            for board_id in board_ids:
+                c.execute("INSERT INTO messages (message, timestamp, type, status, attempts, board_id) VALUES (?, ?, ?, ?, ?, ?)",
+                          (message, now, msg_type, 'sending', 0, board_id))
+                message_ids[board_id] = c.lastrowid
+        start = datetime.now()
+        sent = delivery.fan_out(lambda board_id: send_message(payloads[board_id], board_id), board_ids)
+        elapsed = (datetime.now() - start).total_seconds()
+        results = {}
+        for board_id, result in sent.items():
+            record_delivery(message_ids[board_id], 'sent' if result.ok else 'failed', 1, result.error)
+            results[board_id] = {'id': message_ids[board_id], 'ok': result.ok,
+                                 'elapsed': round(result.elapsed, 4), 'error': result.error}
+        return jsonify({'status': 'success', 'elapsed': round(elapsed, 4), 'results': results})
     except Exception as e:
-        return jsonify({'online': False, 'error': str(e)})
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """Server-sent events: new messages, delivery results and board up/down changes
+
+    ?topics= picks a comma-separated subset of message, delivery and board;
+    ?last_event_id= stands in for the Last-Event-ID header on a fresh connection;
+    message and delivery need a logged-in user. Board events start with the
+    current status of every board. Each open stream holds a request thread,
+    so this needs a threaded server (gunicorn -k gthread, or gevent) and is
+    capped at SSE_MAX_CLIENTS streams per process. Every process sees every
+    message, whichever one logged it, within events.POLL_INTERVAL.
+    """
+    requested = request.args.get('topics')
+    topics = set(requested.split(',')) if requested else set(events.TOPICS)
+    topics &= set(events.TOPICS)
+    if not current_user.is_authenticated:
+        topics &= {'board'}
+    if not topics:
+        return jsonify({'error': 'No topics available'}), 401 if not current_user.is_authenticated else 400
+    initial = [('board', board_event(board_id)) for board_id in board_monitor.online()] if 'board' in topics else []
+    try:
+        last_event_id = request.headers.get('Last-Event-ID', type=int)
+        if last_event_id is None:
+            last_event_id = request.args.get('last_event_id', type=int)
+        subscription = event_hub.subscribe(topics, last_event_id, initial)
+    except events.TooManyClients as e:
+        return jsonify({'error': str(e)}), 503
+    return app.response_class(event_hub.stream(subscription), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/frames/stats', methods=['GET'])
+def api_frame_stats():
+    """Bytes on the wire and encode time of rendered frames, per board"""
+    return jsonify({'boards': {board_id: stream.stats() for board_id, stream in list(frame_streams.items())}})
+
+@app.route('/api/db/stats', methods=['GET'])
+def api_db_stats():
+    """Per-query timing collected by the database layer"""
+    return jsonify({'queries': db.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
 
 # CORS support for frontend
 @app.after_request
 def after_request(response):
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route, request.method, response.status_code)
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
+metrics.Gauge('ledboard_scheduler_leader', 'Whether this process holds the scheduler lease.',
+              collect=lambda: {(): int(election is not None and election.leader)})
+
+# Startup
+_startup_lock = threading.Lock()
+_started = False
+
+def create_app():
+    """Migrate and seed the database and start the background services, once per process
+
+    Importing this module does no work of its own, so WSGI servers can
+    load "app:create_app()"; a plain "app:app" starts on its first request.
+    """
+    global scheduler, user_schedules, election, _started
+    with _startup_lock:
+        if _started:
+            return app
+        init_db()
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        # Scheduler: runs paused until this process wins the scheduler lease,
+        # so several web workers never fire the same job. A missed run is caught
+        # up after a takeover as long as it is within the grace time.
+        scheduler = BackgroundScheduler(job_defaults={'misfire_grace_time': 60, 'coalesce': True})
+        scheduler.start(paused=True)
+
+        # Schedule daily tasks
+        scheduler.add_job(lambda: prepare_birthday_messages(), 'cron', hour=20, minute=0)
+        scheduler.add_job(lambda: send_birthday_messages(), 'cron', hour=9, minute=0)
+        scheduler.add_job(lambda: send_news(), 'cron', hour=18, minute=0)
+        scheduler.add_job(lambda: message_log.rollup(), 'cron', hour=3, minute=0)
+        scheduler.add_job(lambda: health.prune(), 'cron', hour=3, minute=30)
+        # Messages whose process exited before delivering them; swept again while running
+        # because other workers may still hold recent ones at startup
+        fail_stale_messages()
+        scheduler.add_job(lambda: fail_stale_messages(), 'interval', minutes=10)
+
+        # User schedules live in the schedules table; one job per time slot is rebuilt from it at startup
+        user_schedules = schedules.ScheduleSlots(scheduler, lambda message: queue_message(message, 'scheduled'))
+        user_schedules.rehydrate()
+        # Picks up schedules edited through other workers
+        scheduler.add_job(lambda: user_schedules.rehydrate(), 'interval', seconds=10, id='schedule-rehydrate')
+
+        def on_elected():
+            user_schedules.rehydrate()
+            scheduler.resume()
+            playlist_engine.start()
+
+        def on_demoted():
+            scheduler.pause()
+            playlist_engine.stop()
+
+        election = leader.LeaderElection('scheduler', on_elected=on_elected, on_demoted=on_demoted)
+        election.start()
+        board_monitor.start()
+        message_tail.start(message_log.last_change())
+        _started = True
+    return app
+
+@app.before_request
+def ensure_started():
+    if not _started:
+        create_app()
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from werkzeug.security import check_password_hash
+
+# Password hashing is CPU-bound (~0.3s each); at most this many run at once
+VERIFY_WORKERS = 4
+# Checks allowed to wait for a worker before logins are turned away
+MAX_PENDING_VERIFICATIONS = 32
+# Cached logged-in users
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 300.0
+# How often the cache checks whether the users table changed
+USER_VERSION_CHECK = 1.0
+
+# Checked against when the user does not exist, so a miss costs as much as a wrong password
+_DUMMY_HASH = b'$2b$12$GnGLrG1Rn/k6E4ZgYWls6uzdxsK9V2BYsvrSHW6nfbtIu4.NvsLjO'
+
+_verify_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='password')
+_pending = threading.BoundedSemaphore(MAX_PENDING_VERIFICATIONS)
+
+
+class VerifierBusy(Exception):
+    pass
+
+
+def hash_password(password):
+    """bcrypt hash of a password, computed on the verifier pool."""
+    return _verify_pool.submit(lambda: bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()).result()
+
+
+def _check(password, hashed):
+    if hashed is None:
+        bcrypt.checkpw(password.encode(), _DUMMY_HASH)
+        return False
+    if hashed.startswith('$2'):
+        try:
+            return bcrypt.checkpw(password.encode(), hashed.encode())
+        except ValueError:
+            return False
+    # Older rows were written with werkzeug's generate_password_hash
+    return check_password_hash(hashed, password)
+
+
+def needs_rehash(hashed):
+    return not hashed.startswith('$2')
+
+
+def verify_password(password, hashed):
+    """Check a password against a stored hash (None for an unknown user) on the verifier pool.
+
+    Raises VerifierBusy when too many checks are already waiting.
+    """
+    if not _pending.acquire(blocking=False):
+        raise VerifierBusy('Too many logins in progress')
+    try:
+        return _verify_pool.submit(_check, password, hashed).result()
+    finally:
+        _pending.release()
+
+
+class UserCache:
+    """LRU cache of logged-in users with a TTL.
+
+    If given, version() returns the users table's change counter; it is
+    checked at most every check_interval seconds and the cache is cleared
+    when it moves.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, version=None, check_interval=USER_VERSION_CHECK):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_source = version
+        self.check_interval = check_interval
+        self.entries = OrderedDict()  # user id -> (user, loaded at)
+        self.version = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def _check_version(self, now):
+        if self.version_source is None or (self.checked_at is not None and now - self.checked_at < self.check_interval):
+            return
+        version = self.version_source()
+        with self.lock:
+            self.checked_at = now
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def get(self, user_id, load):
+        """Cached user for user_id, calling load(user_id) on a miss; None results are not cached."""
+        now = time.monotonic()
+        self._check_version(now)
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.entries.move_to_end(user_id)
+                return entry[0]
+        user = load(user_id)
+        if user is not None:
+            with self.lock:
+                self.entries[user_id] = (user, now)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None):
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
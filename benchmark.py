@@ -0,0 +1,229 @@
+"""End-to-end benchmarks of the send path against the local board emulator.
+
+Runs app.py on a throwaway database with its boards pointed at an
+emulated board (see emulator.py) and reports throughput and p50/p99
+latency per scenario:
+
+    python benchmark.py
+    python benchmark.py --scenarios send_http api_message -n 500 --latency 5
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json    # exits 1 on a regression
+    python benchmark.py --startup                   # cold start time and memory only
+
+Queued scenarios (/api/message, /api/program) count throughput until every
+queued message has been delivered, latency per HTTP request.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+import importer
+from emulator import BoardEmulator
+
+PROGRAM = [
+    {'type': 'text', 'x': 0, 'y': 0, 'properties': {'text': 'Happy Birthday!', 'fontSize': 8, 'color': '#FF0000'}},
+    {'type': 'clock', 'x': 60, 'y': 8, 'properties': {'format': '24h'}},
+]
+
+
+# Run in a fresh interpreter to time one worker's import and startup
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import db
+db.DATABASE = sys.argv[1]
+import app
+imported = time.perf_counter()
+app.create_app()
+started = time.perf_counter()
+print(json.dumps({'import_s': imported - start, 'startup_s': started - imported,
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def measure_startup():
+    """Time a worker starting on a new database, then restarting on the same one."""
+    path = os.path.join(tempfile.mkdtemp(prefix='ledboard-startup-'), 'birthdays.db')
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = {}
+    for name in ('new_database', 'restart'):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, path], cwd=here, check=True,
+                                capture_output=True, text=True).stdout
+        runs[name] = json.loads(output.strip().splitlines()[-1])
+    return runs
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+class Bench:
+    def __init__(self, app, emulator, iterations, rows):
+        self.app = app
+        self.client = app.app.test_client()
+        self.emulator = emulator
+        self.iterations = iterations
+        self.rows = rows
+        self.uploads = 0
+
+    def setup(self):
+        app = self.app
+        db.execute("UPDATE boards SET ip='127.0.0.1', port=?, protocol='HTTP', frames=1, width=96, height=16 WHERE id=1",
+                   (self.emulator.http_port,))
+        db.execute('''INSERT OR REPLACE INTO boards (id, name, ip, port, protocol, active, width, height, frames)
+                      VALUES (2, 'Emulator TCP', '127.0.0.1', ?, 'TCP', 1, 96, 16, 1)''', (self.emulator.tcp_port,))
+        app.cached_settings.refresh()
+        app.board_monitor.check_now()
+        # The dashboard is measured against one upload's worth of birthdays
+        importer.import_birthdays(db.get_conn(), ((n, f'Seed {n}', f'{1960 + n % 50}-{1 + n % 12:02d}-{1 + n % 28:02d}')
+                                                  for n in range(self.rows)))
+        response = self.client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        if response.status_code != 302:
+            raise RuntimeError('Could not log in as admin')
+
+    def timed(self, call):
+        latencies = []
+        start = time.perf_counter()
+        for i in range(self.iterations):
+            began = time.perf_counter()
+            call(i)
+            latencies.append(time.perf_counter() - began)
+        return latencies, start
+
+    def send_http(self):
+        return self.timed(lambda i: self._check(self.app.send_message(f'Benchmark {i}', 1)))
+
+    def send_tcp(self):
+        return self.timed(lambda i: self._check(self.app.send_message(f'Benchmark {i}', 2)))
+
+    def api_message(self):
+        latencies, start = self.timed(lambda i: self._post('/api/message', {'text': f'Benchmark {i}'}))
+        self.app.outbox.join()
+        return latencies, start
+
+    def api_program(self):
+        latencies, start = self.timed(lambda i: self._post('/api/program', {'widgets': PROGRAM}))
+        self.app.outbox.join()
+        return latencies, start
+
+    def upload(self):
+        def upload(i):
+            self.uploads += 1
+            lines = ['Name,DateOfBirth'] + [f'Person {self.uploads}-{n},{1960 + n % 50}-{1 + n % 12:02d}-{1 + n % 28:02d}'
+                                            for n in range(self.rows)]
+            data = {'file': (io.BytesIO('\n'.join(lines).encode()), 'birthdays.csv')}
+            response = self.client.post('/birthdays', data=data, content_type='multipart/form-data')
+            if response.status_code != 302:
+                raise RuntimeError(f'Upload failed with {response.status_code}')
+        return self.timed(upload)
+
+    def dashboard(self):
+        return self.timed(lambda i: self._get('/'))
+
+    def _post(self, path, body):
+        response = self.client.post(path, json=body)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{path} returned {response.status_code}')
+
+    def _get(self, path):
+        response = self.client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}')
+
+    @staticmethod
+    def _check(result):
+        if not result.ok:
+            raise RuntimeError(f'Send failed: {result.error}')
+
+
+SCENARIOS = ('send_http', 'send_tcp', 'api_message', 'api_program', 'dashboard', 'upload')
+
+
+def run(scenarios, iterations, rows, emulator_options):
+    workdir = tempfile.mkdtemp(prefix='ledboard-bench-')
+    db.DATABASE = os.path.join(workdir, 'birthdays.db')
+    emulator = BoardEmulator(**emulator_options).start()
+    log = io.StringIO()
+    results = {}
+    try:
+        with contextlib.redirect_stdout(log):
+            import app
+            app.create_app()
+            app.app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+            bench = Bench(app, emulator, iterations, rows)
+            bench.setup()
+            for name in scenarios:
+                latencies, start = getattr(bench, name)()
+                elapsed = time.perf_counter() - start
+                results[name] = {
+                    'n': len(latencies),
+                    'throughput': len(latencies) / elapsed,
+                    'p50_ms': percentile(latencies, 0.50) * 1000,
+                    'p99_ms': percentile(latencies, 0.99) * 1000,
+                }
+    finally:
+        emulator.stop()
+    return results, emulator.stats()
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            found.append(f"{name}: throughput {result['throughput']:.1f}/s vs {before['throughput']:.1f}/s")
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            found.append(f"{name}: p99 {result['p99_ms']:.2f}ms vs {before['p99_ms']:.2f}ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the LED board send path against an emulated board.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=2000, help='rows per birthday upload')
+    parser.add_argument('--latency', type=float, default=0.0, help='emulated board latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- milliseconds of emulated latency')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before failing, as a fraction')
+    parser.add_argument('--startup', action='store_true', help='only measure cold start time and memory')
+    args = parser.parse_args()
+
+    if args.startup:
+        print(f"{'startup':<14} {'import s':>9} {'start s':>9} {'max RSS MB':>11}")
+        for name, stats in measure_startup().items():
+            print(f"{name:<14} {stats['import_s']:>9.3f} {stats['startup_s']:>9.3f} {stats['max_rss_mb']:>11.1f}")
+        return
+
+    results, board = run(args.scenarios, args.iterations, args.rows,
+                         {'latency': args.latency / 1000, 'jitter': args.jitter / 1000, 'seed': 1})
+    print(f"{'scenario':<12} {'n':>6} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, result in results.items():
+        print(f"{name:<12} {result['n']:>6} {result['throughput']:>10.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+    print(f'Emulated board received: {board}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f'Regression: {line}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
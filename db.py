@@ -0,0 +1,393 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import upcoming
+
+DATABASE = 'birthdays.db'
+
+# Applied to every new connection; WAL lets the scheduler and web threads
+# read while another thread writes
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA temp_store=MEMORY',
+)
+# Compiled statements kept per connection by the sqlite3 module
+STATEMENT_CACHE_SIZE = 256
+SLOW_QUERY = 0.1  # seconds
+
+_local = threading.local()
+_stats = {}
+_stats_lock = threading.Lock()
+# Callables invoked as observer(sql, seconds) after every statement
+query_observers = []
+
+
+def _record(sql, seconds):
+    with _stats_lock:
+        entry = _stats.get(sql)
+        if entry is None:
+            _stats[sql] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+    for observer in query_observers:
+        observer(sql, seconds)
+    if seconds > SLOW_QUERY:
+        print(f'Slow query ({seconds:.3f}s): {sql}')
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            _record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            _record(sql, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+
+def connect(path=None):
+    """Open a new tuned connection; most callers want get_conn() instead."""
+    conn = sqlite3.connect(path or DATABASE, factory=TimedConnection, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_conn():
+    """Return this thread's connection, opening it on first use.
+
+    The connection is released with the thread's local storage when the
+    thread exits.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+    return conn
+
+
+def close():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def query(sql, params=()):
+    return get_conn().execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    return get_conn().execute(sql, params).fetchone()
+
+
+def execute(sql, params=()):
+    """Run one write statement and commit it; returns the cursor."""
+    conn = get_conn()
+    try:
+        c = conn.execute(sql, params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return c
+
+
+def data_version(name):
+    """Change counter for a group of tables in data_versions ('users', 'playlists')."""
+    row = query_one("SELECT version FROM data_versions WHERE name=?", (name,))
+    return row[0] if row else None
+
+
+@contextmanager
+def transaction():
+    """Yield a cursor whose statements commit together or not at all."""
+    conn = get_conn()
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def stats():
+    """Per-statement timing: {sql: {'count', 'total', 'max'}}."""
+    with _stats_lock:
+        return {sql: {'count': count, 'total': total, 'max': worst} for sql, (count, total, worst) in _stats.items()}
+
+
+# Schema migrations
+
+def add_missing_columns(c, table, columns):
+    """Add columns in place for databases created before they existed"""
+    c.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in c.fetchall()}
+    for column, decl in columns:
+        if column not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _base_schema(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS birthdays
+                 (id INTEGER PRIMARY KEY, name TEXT, dob TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS messages
+                 (id INTEGER PRIMARY KEY, message TEXT, timestamp TEXT, type TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS schedules
+                 (id INTEGER PRIMARY KEY, time TEXT, message TEXT, active INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, role TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS board_settings
+                 (id INTEGER PRIMARY KEY, ssid TEXT, password TEXT, ip TEXT, port INTEGER, protocol TEXT, brightness INTEGER, font_size INTEGER, color TEXT, effect TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS ai_settings
+                 (id INTEGER PRIMARY KEY, style TEXT, language TEXT, tone TEXT)''')
+
+
+def _delivery_tracking(c):
+    add_missing_columns(c, 'messages', (('status', 'TEXT'), ('attempts', 'INTEGER DEFAULT 0'), ('error', 'TEXT'),
+                                        ('delivered_at', 'TEXT'), ('board_id', 'INTEGER')))
+
+
+def _board_registry(c):
+    # Board 1 is the display configured on the settings page
+    c.execute('''CREATE TABLE IF NOT EXISTS boards
+                 (id INTEGER PRIMARY KEY, name TEXT, ip TEXT, port INTEGER, ssid TEXT, wifi_pass TEXT, protocol TEXT)''')
+    add_missing_columns(c, 'boards', (('active', 'INTEGER DEFAULT 1'),))
+
+
+def _birthday_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_birthdays_name_dob ON birthdays (name, dob)")
+    # Month-day key for indexed upcoming-birthday windows, kept filled by triggers
+    add_missing_columns(c, 'birthdays', (('birth_md', 'INTEGER'),))
+    birth_md = upcoming.BIRTH_MD_SQL.format(dob='NEW.dob')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS birthdays_md_insert AFTER INSERT ON birthdays
+                  WHEN NEW.birth_md IS NULL
+                  BEGIN UPDATE birthdays SET birth_md = {birth_md} WHERE id = NEW.id; END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS birthdays_md_update AFTER UPDATE OF dob ON birthdays
+                  BEGIN UPDATE birthdays SET birth_md = {birth_md} WHERE id = NEW.id; END''')
+    c.execute(f"UPDATE birthdays SET birth_md = {upcoming.BIRTH_MD_SQL.format(dob='dob')} WHERE birth_md IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_birthdays_md ON birthdays (birth_md)")
+
+
+def _settings_version(c):
+    # Bumped by any write to cached settings tables so every process can
+    # tell its cached copy is stale with a single-row read
+    c.execute('''CREATE TABLE IF NOT EXISTS settings_version
+                 (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)''')
+    c.execute("INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, 0)")
+    for table in ('board_settings', 'ai_settings', 'boards'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table}
+                          BEGIN UPDATE settings_version SET version = version + 1 WHERE id = 1; END''')
+
+
+def _message_log(c):
+    # Keyset pagination indexes, full-text search and retention rollups
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_type_timestamp ON messages (type, timestamp, id)")
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+                 USING fts5(message, content='messages', content_rowid='id')''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+                 BEGIN INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+                 BEGIN INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages
+                 BEGIN
+                     INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message);
+                     INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message);
+                 END''')
+    c.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    c.execute('''CREATE TABLE IF NOT EXISTS message_daily_counts
+                 (day TEXT, type TEXT, count INTEGER NOT NULL, PRIMARY KEY (day, type))''')
+
+
+def _board_geometry(c):
+    # Display size in pixels and whether the controller accepts rendered frames
+    add_missing_columns(c, 'boards', (('width', 'INTEGER DEFAULT 96'), ('height', 'INTEGER DEFAULT 16'),
+                                      ('frames', 'INTEGER DEFAULT 0')))
+
+
+def _ai_message_cache(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS ai_message_cache
+                 (key TEXT PRIMARY KEY, name TEXT, style TEXT, language TEXT, tone TEXT, day TEXT,
+                  message TEXT, created_at TEXT, last_used TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_message_cache_last_used ON ai_message_cache (last_used)")
+
+
+def _news(c):
+    # Headlines seen in the feed (and when shown) plus AI summaries per language
+    c.execute('''CREATE TABLE IF NOT EXISTS news_headlines
+                 (hash TEXT PRIMARY KEY, title TEXT, first_seen TEXT, shown_at TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS news_summaries
+                 (hash TEXT, language TEXT, summary TEXT, created_at TEXT, PRIMARY KEY (hash, language))''')
+
+
+def _schedule_slots(c):
+    # Schedules are grouped by time slot, so times must compare equal as text
+    for schedule_id, value in c.execute("SELECT id, time FROM schedules").fetchall():
+        hour, _, minute = str(value or '').strip().partition(':')
+        try:
+            hour, minute = int(hour), int(minute)
+        except ValueError:
+            hour = minute = -1
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            c.execute("UPDATE schedules SET time=? WHERE id=?", (f'{hour:02d}:{minute:02d}', schedule_id))
+        else:
+            c.execute("UPDATE schedules SET active=0 WHERE id=?", (schedule_id,))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_schedules_active_time ON schedules (active, time)")
+
+
+def _leases(c):
+    # Leader election: expires_at is a Unix timestamp renewed by the holder
+    c.execute('''CREATE TABLE IF NOT EXISTS leases
+                 (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)''')
+
+
+def _board_health(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS board_health
+                 (id INTEGER PRIMARY KEY, board_id INTEGER, checked_at TEXT, online INTEGER, latency_ms REAL, error TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_board_health_board_checked ON board_health (board_id, checked_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_board_health_checked ON board_health (checked_at)")
+
+
+def _unique_usernames(c):
+    # Older databases lack the UNIQUE constraint, so every start used to add
+    # another admin row; the newest one holds the password the seed set
+    c.execute("DELETE FROM users WHERE id NOT IN (SELECT MAX(id) FROM users GROUP BY username)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username)")
+
+
+def _users_version(c):
+    # Cached logged-in users are dropped when the users table changes
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS users_{event.lower()}_version AFTER {event} ON users
+                      BEGIN UPDATE settings_version SET version = version + 1 WHERE id = 1; END''')
+
+
+def _playlists(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS programs
+                 (id INTEGER PRIMARY KEY, name TEXT, widgets TEXT NOT NULL, created_at TEXT, updated_at TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS playlists
+                 (id INTEGER PRIMARY KEY, name TEXT, active INTEGER DEFAULT 1)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS playlist_items
+                 (id INTEGER PRIMARY KEY, playlist_id INTEGER NOT NULL, program_id INTEGER NOT NULL,
+                  position INTEGER NOT NULL, dwell REAL NOT NULL)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_playlist_items_playlist ON playlist_items (playlist_id, position)")
+    add_missing_columns(c, 'boards', (('playlist_id', 'INTEGER'),))
+    # The playlist engine reloads when the settings version moves
+    for table in ('programs', 'playlists', 'playlist_items'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table}
+                          BEGIN UPDATE settings_version SET version = version + 1 WHERE id = 1; END''')
+
+
+
+def _message_type_counts(c):
+    # Per-type totals for the logs page: `live` is kept by triggers on
+    # messages, `archived` by rollup() as it folds old rows away
+    c.execute('''CREATE TABLE IF NOT EXISTS message_type_counts
+                 (type TEXT PRIMARY KEY, live INTEGER NOT NULL DEFAULT 0, archived INTEGER NOT NULL DEFAULT 0)''')
+    c.execute("DELETE FROM message_type_counts")
+    c.execute('''INSERT INTO message_type_counts (type, live)
+                 SELECT COALESCE(type, ''), COUNT(*) FROM messages GROUP BY 1''')
+    c.execute('''INSERT INTO message_type_counts (type, archived)
+                 SELECT type, SUM(count) FROM message_daily_counts GROUP BY type
+                 ON CONFLICT (type) DO UPDATE SET archived = excluded.archived''')
+    add = '''INSERT INTO message_type_counts (type, live) VALUES (COALESCE(NEW.type, ''), 1)
+             ON CONFLICT (type) DO UPDATE SET live = live + 1;'''
+    remove = "UPDATE message_type_counts SET live = live - 1 WHERE type = COALESCE(OLD.type, '');"
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS messages_count_insert AFTER INSERT ON messages BEGIN {add} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS messages_count_delete AFTER DELETE ON messages BEGIN {remove} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS messages_count_update AFTER UPDATE OF type ON messages BEGIN {remove} {add} END")
+
+
+
+def _data_versions(c):
+    # Users and playlists get their own change counters; bumping the settings
+    # version made every login rehash or program save reload all settings
+    c.execute('''CREATE TABLE IF NOT EXISTS data_versions
+                 (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)''')
+    for name, tables in (('users', ('users',)), ('playlists', ('programs', 'playlists', 'playlist_items'))):
+        c.execute("INSERT OR IGNORE INTO data_versions (name) VALUES (?)", (name,))
+        for table in tables:
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                c.execute(f"DROP TRIGGER IF EXISTS {table}_{event.lower()}_version")
+                c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_data_version AFTER {event} ON {table}
+                              BEGIN UPDATE data_versions SET version = version + 1 WHERE name = '{name}'; END''')
+
+
+def _message_changes(c):
+    # Every insert and status change on messages, in order, so each server
+    # process can tail one table for live events whichever process wrote them
+    c.execute('''CREATE TABLE IF NOT EXISTS message_changes
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT, message_id INTEGER NOT NULL, topic TEXT NOT NULL)''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_change_insert AFTER INSERT ON messages
+                 BEGIN INSERT INTO message_changes (message_id, topic) VALUES (new.id, 'message'); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_change_status AFTER UPDATE OF status ON messages
+                 WHEN new.status IS NOT old.status
+                 BEGIN INSERT INTO message_changes (message_id, topic) VALUES (new.id, 'delivery'); END''')
+
+
+# Applied in order; PRAGMA user_version records how many have run. Steps
+# are idempotent because databases predating versioning may already have
+# some of them.
+MIGRATIONS = [
+    _base_schema,
+    _delivery_tracking,
+    _board_registry,
+    _birthday_indexes,
+    _settings_version,
+    _message_log,
+    _board_geometry,
+    _ai_message_cache,
+    _news,
+    _schedule_slots,
+    _leases,
+    _board_health,
+    _unique_usernames,
+    _users_version,
+    _playlists,
+    _message_type_counts,
+    _data_versions,
+    _message_changes,
+]
+
+
+def migrate(conn=None):
+    conn = conn or get_conn()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        c = conn.cursor()
+        try:
+            migration(c)
+            c.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(MIGRATIONS)
@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Pending messages allowed per board before submit() starts refusing work
+MAX_PENDING = 500
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 1.0  # seconds, doubled after every failed attempt
+# How long a message may wait for its board to come back before it fails
+HOLD_TIMEOUT = 600.0
+# Boards contacted at once by a broadcast
+FAN_OUT_WORKERS = 32
+
+
+WORKER_ERRORS = metrics.Counter('ledboard_delivery_worker_errors_total',
+                                'Unexpected exceptions raised inside delivery workers.', ('board_id',))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class DeliveryQueue:
+    """Background delivery with one ordered worker per board.
+
+    deliver(board_id, message) must return a transport.SendResult and
+    record(message_id, status, attempts, error) stores the final outcome.
+    If given, wait_ready(board_id, timeout) is called before each attempt
+    and blocks while the board is known to be down, so messages are held
+    for up to `hold` seconds instead of burning their attempts.
+    """
+
+    def __init__(self, deliver, record, max_pending=MAX_PENDING, max_attempts=MAX_ATTEMPTS, backoff=RETRY_BACKOFF,
+                 wait_ready=None, hold=HOLD_TIMEOUT):
+        self.deliver = deliver
+        self.record = record
+        self.wait_ready = wait_ready
+        self.hold = hold
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def _queue_for(self, board_id):
+        with self.lock:
+            q = self.queues.get(board_id)
+            if q is None:
+                q = queue.Queue(maxsize=self.max_pending)
+                self.queues[board_id] = q
+                worker = threading.Thread(target=self._worker, args=(board_id, q), daemon=True,
+                                          name=f'delivery-{board_id}')
+                worker.start()
+            return q
+
+    def submit(self, board_id, message_id, message):
+        try:
+            self._queue_for(board_id).put_nowait((message_id, message, time.monotonic()))
+        except queue.Full:
+            raise QueueFull(f'Delivery queue for board {board_id} is full')
+
+    def submit_many(self, board_id, items):
+        """Queue [(message_id, message)] for one board in order; returns how many fit.
+
+        Items after the first that does not fit are not queued, so the
+        caller can mark exactly that tail as dropped.
+        """
+        q = self._queue_for(board_id)
+        queued_at = time.monotonic()
+        for count, (message_id, message) in enumerate(items):
+            try:
+                q.put_nowait((message_id, message, queued_at))
+            except queue.Full:
+                return count
+        return len(items)
+
+    def free(self, board_id):
+        """How many more messages board_id's queue takes right now."""
+        with self.lock:
+            q = self.queues.get(board_id)
+        return self.max_pending if q is None else max(0, self.max_pending - q.qsize())
+
+    def depth(self):
+        with self.lock:
+            return {board_id: q.qsize() for board_id, q in self.queues.items()}
+
+    def _worker(self, board_id, q):
+        while True:
+            message_id, message, queued_at = q.get()
+            try:
+                self._deliver(board_id, message_id, message, queued_at + self.hold)
+            except Exception as e:
+                WORKER_ERRORS.inc(board_id)
+                print(f'Delivery worker for board {board_id} failed on message {message_id}: {e}')
+            finally:
+                q.task_done()
+
+    def _deliver(self, board_id, message_id, message, deadline):
+        delay = self.backoff
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if self.wait_ready and not self.wait_ready(board_id, max(0.0, deadline - time.monotonic())):
+                self.record(message_id, 'failed', attempt - 1, error or 'Board offline')
+                return
+            result = self.deliver(board_id, message)
+            if result.ok:
+                self.record(message_id, 'sent', attempt, None)
+                return
+            error = result.error
+            if attempt < self.max_attempts:
+                time.sleep(delay)
+                delay *= 2
+        self.record(message_id, 'failed', self.max_attempts, error)
+
+    def join(self):
+        """Block until every message queued so far has a final status."""
+        with self.lock:
+            queues = list(self.queues.values())
+        for q in queues:
+            q.join()
+
+
+_fan_out_pool = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix='fan-out')
+
+
+def fan_out(deliver, board_ids):
+    """Call deliver(board_id) for every board concurrently.
+
+    Returns {board_id: SendResult}; total time tracks the slowest board
+    rather than the sum of all of them.
+    """
+    futures = {board_id: _fan_out_pool.submit(deliver, board_id) for board_id in board_ids}
+    return {board_id: future.result() for board_id, future in futures.items()}
@@ -0,0 +1,234 @@
+"""Local stand-in for the P10 LED controller.
+
+Speaks the same protocols as the real board, so the send path can be
+exercised without the board's Wi-Fi network:
+
+    HTTP  POST /display  {"message": ...}
+          POST /frame    packed frame or delta (application/octet-stream)
+    TCP   newline-terminated text, or STX + big-endian length + frame
+
+Latency, jitter, dropped requests and occasional slow responses are
+configurable to mimic a struggling board:
+
+    python emulator.py --http-port 8080 --tcp-port 9090 --latency 20 --drop 0.01
+"""
+import argparse
+import json
+import random
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import frame_diff
+import renderer
+import transport
+
+
+class BoardEmulator:
+    """An emulated board listening on HTTP and TCP ports (0 picks free ones).
+
+    latency/jitter/slow_latency are in seconds; drop and slow are the
+    fractions of requests that are dropped or answered after slow_latency.
+    """
+
+    def __init__(self, host='127.0.0.1', http_port=0, tcp_port=0, latency=0.0, jitter=0.0, drop=0.0, slow=0.0,
+                 slow_latency=1.0, seed=None, verbose=False):
+        self.host = host
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.slow = slow
+        self.slow_latency = slow_latency
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages = deque(maxlen=1000)
+        self.frame = None
+        self.counts = {'messages': 0, 'frames': 0, 'deltas': 0, 'bytes': 0, 'dropped': 0, 'slow': 0, 'errors': 0}
+        self.http = ThreadingHTTPServer((host, http_port), _HttpHandler)
+        self.http.daemon_threads = True
+        self.http.emulator = self
+        self.tcp = _TcpServer((host, tcp_port), _TcpHandler)
+        self.tcp.emulator = self
+        self.threads = []
+
+    @property
+    def http_port(self):
+        return self.http.server_address[1]
+
+    @property
+    def tcp_port(self):
+        return self.tcp.server_address[1]
+
+    def start(self):
+        for server in (self.http, self.tcp):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in (self.http, self.tcp):
+            server.shutdown()
+            server.server_close()
+
+    def behave(self):
+        """Apply the configured latency; returns False if this request should be dropped."""
+        with self.lock:
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            if roll < self.drop:
+                self.counts['dropped'] += 1
+                return False
+            if roll < self.drop + self.slow:
+                self.counts['slow'] += 1
+                delay += self.slow_latency
+        if delay:
+            time.sleep(delay)
+        return True
+
+    def show_text(self, text):
+        with self.lock:
+            self.counts['messages'] += 1
+            self.counts['bytes'] += len(text.encode())
+            self.messages.append(text)
+        if self.verbose:
+            print(f'Display: {text}')
+
+    def show_frame(self, data, base=None, per_connection=False):
+        """Decode a keyframe or apply a delta and return the new framebuffer.
+
+        HTTP shares one framebuffer across requests. A TCP connection starts
+        with none (per_connection, base is what it has shown so far), like a
+        controller that resets on reconnect. Raises ValueError for bad data.
+        """
+        with self.lock:
+            if not per_connection:
+                base = self.frame
+            if data[:4] == renderer.FRAME_MAGIC:
+                frame = renderer.unpack_frame(data)
+                self.counts['frames'] += 1
+            elif data[:4] == frame_diff.DELTA_MAGIC:
+                if base is None:
+                    raise ValueError('Delta received before any keyframe')
+                frame = frame_diff.apply_delta(base, data)
+                self.counts['deltas'] += 1
+            else:
+                raise ValueError('Unknown frame format')
+            self.counts['bytes'] += len(data)
+            self.frame = frame
+            return frame
+
+    def error(self):
+        with self.lock:
+            self.counts['errors'] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the transport expects
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        emulator = self.server.emulator
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if not emulator.behave():
+            self.close_connection = True
+            return
+        try:
+            if self.path == '/display':
+                emulator.show_text(json.loads(body)['message'])
+            elif self.path == '/frame':
+                emulator.show_frame(body)
+            else:
+                self._reply(404, b'Not found')
+                return
+        except (ValueError, KeyError, TypeError) as e:
+            emulator.error()
+            self._reply(400, str(e).encode())
+            return
+        self._reply(200, b'OK')
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.emulator.verbose:
+            super().log_message(format, *args)
+
+
+class _TcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _TcpHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        emulator = self.server.emulator
+        frame = None
+        while True:
+            first = self.rfile.read(1)
+            if not first:
+                return
+            if first == transport.TCP_FRAME_START:
+                header = self.rfile.read(4)
+                if len(header) < 4:
+                    return
+                data = self.rfile.read(struct.unpack('>I', header)[0])
+            else:
+                data = first + self.rfile.readline()
+                if not data.endswith(transport.TCP_DELIMITER):
+                    return
+            if not emulator.behave():
+                return  # the board hangs up; the sender reconnects on its next message
+            try:
+                if first == transport.TCP_FRAME_START:
+                    frame = emulator.show_frame(data, frame, per_connection=True)
+                else:
+                    emulator.show_text(data[:-len(transport.TCP_DELIMITER)].decode(errors='replace'))
+            except ValueError as e:
+                emulator.error()
+                if emulator.verbose:
+                    print(f'Bad frame: {e}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate a P10 LED board on HTTP and TCP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=8080)
+    parser.add_argument('--tcp-port', type=int, default=9090)
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- milliseconds of random latency')
+    parser.add_argument('--drop', type=float, default=0.0, help='fraction of requests dropped')
+    parser.add_argument('--slow', type=float, default=0.0, help='fraction of requests answered slowly')
+    parser.add_argument('--slow-latency', type=float, default=1000.0, help='milliseconds added to slow requests')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+    emulator = BoardEmulator(args.host, args.http_port, args.tcp_port, args.latency / 1000, args.jitter / 1000,
+                             args.drop, args.slow, args.slow_latency / 1000, args.seed, verbose=not args.quiet).start()
+    print(f'Emulating a board on http://{args.host}:{emulator.http_port} and tcp://{args.host}:{emulator.tcp_port}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+        print(emulator.stats())
+
+
+if __name__ == '__main__':
+    main()
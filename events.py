@@ -0,0 +1,147 @@
+import itertools
+import json
+import queue
+import threading
+from collections import deque, namedtuple
+
+TOPICS = ('message', 'delivery', 'board')
+# Recent events replayed to clients that reconnect with Last-Event-ID
+REPLAY = 256
+# Events buffered per client; a client that falls this far behind is disconnected
+CLIENT_QUEUE = 256
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT = 15.0
+# Streams held open per process; each one occupies a request thread for as
+# long as it is connected, so keep this below the server's thread count
+MAX_CLIENTS = 256
+# Seconds between polls of a shared change log by Tail
+POLL_INTERVAL = 0.5
+
+Event = namedtuple('Event', ['id', 'topic', 'data'])
+
+
+class TooManyClients(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, topics):
+        self.topics = topics
+        self.queue = queue.Queue(maxsize=CLIENT_QUEUE)
+        self.overflowed = False
+
+
+class EventHub:
+    """Fans published events out to every connected server-sent-events client.
+
+    Publishing serializes the event once and hands it to each matching
+    client's queue without blocking; idle clients only cost a sleeping
+    thread and a keep-alive comment every HEARTBEAT seconds.
+    """
+
+    def __init__(self, replay=REPLAY, max_clients=MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.recent = deque(maxlen=replay)
+        self.ids = itertools.count(1)
+
+    def publish(self, topic, data):
+        payload = json.dumps(data, default=str)
+        with self.lock:
+            event = Event(next(self.ids), topic, payload)
+            self.recent.append(event)
+            subscribers = [sub for sub in self.subscribers if topic in sub.topics]
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                sub.overflowed = True
+
+    def subscribe(self, topics, last_event_id=None, initial=()):
+        """Register a client; initial is a list of (topic, data) sent before live events.
+
+        A client resuming from last_event_id gets the events it missed, or a
+        'reset' event if they are no longer kept (or the server restarted).
+        Raises TooManyClients when max_clients streams are already open.
+        """
+        sub = Subscription(set(topics))
+        for topic, data in initial:
+            sub.queue.put_nowait(Event(None, topic, json.dumps(data, default=str)))
+        with self.lock:
+            if len(self.subscribers) >= self.max_clients:
+                raise TooManyClients(f'{self.max_clients} event streams already open')
+            if last_event_id is not None:
+                first = self.recent[0].id if self.recent else None
+                last = self.recent[-1].id if self.recent else 0
+                if last_event_id > last or (first is not None and last_event_id < first - 1):
+                    sub.queue.put_nowait(Event(None, 'reset', '{}'))
+                else:
+                    for event in self.recent:
+                        if event.id > last_event_id and event.topic in sub.topics and not sub.queue.full():
+                            sub.queue.put_nowait(event)
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+    def stream(self, sub, heartbeat=HEARTBEAT):
+        """Yield the text/event-stream body for a subscription until the client goes away."""
+        try:
+            yield 'retry: 3000\n\n'
+            while not sub.overflowed:
+                try:
+                    event = sub.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                head = f'id: {event.id}\n' if event.id is not None else ''
+                yield f'{head}event: {event.topic}\ndata: {event.data}\n\n'
+            # Too slow to keep up; the browser reconnects and resumes from its last id
+        finally:
+            self.unsubscribe(sub)
+
+    def clients(self):
+        with self.lock:
+            return len(self.subscribers)
+
+
+class Tail:
+    """Feeds a hub from a change log in the database, one thread per process.
+
+    poll(cursor) returns (cursor, [(topic, data)]) for changes after cursor,
+    so clients of every server process see what any of them (or the
+    scheduler leader) wrote. start(cursor) begins after cursor; a poll that
+    moved the cursor is repeated at once to drain a backlog.
+    """
+
+    def __init__(self, hub, poll, interval=POLL_INTERVAL):
+        self.hub = hub
+        self.poll = poll
+        self.interval = interval
+        self.cursor = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, cursor):
+        self.cursor = cursor
+        self.thread = threading.Thread(target=self.run, name='event-tail', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                while True:
+                    cursor, found = self.poll(self.cursor)
+                    for topic, data in found:
+                        self.hub.publish(topic, data)
+                    if cursor == self.cursor:
+                        break
+                    self.cursor = cursor
+            except Exception as e:
+                print(f'Event tail failed: {e}')
@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+import db
+import message_log
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# Rows read per query; memory stays at one chunk however large the export
+CHUNK_ROWS = 1000
+
+MESSAGE_COLUMNS = ('id', 'timestamp', 'type', 'status', 'board_id', 'attempts', 'error', 'delivered_at', 'message')
+BIRTHDAY_COLUMNS = ('id', 'name', 'dob')
+
+
+def parse_bound(value, end=False):
+    """ISO bound for a since/until filter, or None; a bare date as `end` covers that whole day.
+
+    Raises ValueError for anything that is not an ISO date or timestamp.
+    """
+    if not value:
+        return None
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        return (day + timedelta(days=1)).isoformat() if end else day.isoformat()
+    return datetime.fromisoformat(value).isoformat()
+
+
+def _chunks(sql, clauses, params, key, after, limit):
+    """Yield lists of rows in key order, each chunk resuming after the last row of the previous one.
+
+    Every chunk is its own short query, so a slow client never holds a
+    read transaction open and the export can resume from any row.
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = CHUNK_ROWS if remaining is None else min(CHUNK_ROWS, remaining)
+        where = list(clauses)
+        values = list(params)
+        if after is not None:
+            where.append(f"({', '.join(key)}) > ({', '.join('?' * len(key))})" if len(key) > 1 else f"{key[0]} > ?")
+            values.extend(after)
+        query = sql + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {', '.join(key)} LIMIT ?"
+        rows = db.query(query, values + [size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < size:
+            return
+        if remaining is not None:
+            remaining -= len(rows)
+        after = rows[-1][-len(key):]
+
+
+def _encode(chunks, columns, fmt):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(row[:len(columns)] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in chunks:
+            yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+def messages(fmt='csv', msg_type=None, since=None, until=None, after=None, limit=None):
+    """Stream the message log oldest first as CSV or NDJSON text chunks.
+
+    since/until filter on the timestamp; after is the message_log cursor
+    (timestamp~id) of the last row already received.
+    """
+    clauses, params = [], []
+    if msg_type:
+        clauses.append("type = ?")
+        params.append(msg_type)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(parse_bound(since))
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(parse_bound(until, end=True))
+    position = None
+    if after:
+        position = message_log.decode_cursor(after)
+        if position is None:
+            raise ValueError(f'Invalid cursor: {after!r}')
+    sql = "SELECT " + ', '.join(MESSAGE_COLUMNS) + ", timestamp, id FROM messages"
+    return _encode(_chunks(sql, clauses, params, ('timestamp', 'id'), position, limit), MESSAGE_COLUMNS, fmt)
+
+
+def birthdays(fmt='csv', since=None, until=None, after=None, limit=None):
+    """Stream birthdays in id order; since/until filter on the date of birth, after is the last id received."""
+    clauses, params = [], []
+    if since:
+        clauses.append("dob >= ?")
+        params.append(parse_bound(since)[:10])
+    if until:
+        clauses.append("dob < ?")
+        params.append(parse_bound(until, end=True)[:10])
+    position = None
+    if after:
+        if not str(after).isdigit():
+            raise ValueError(f'Invalid cursor: {after!r}')
+        position = (int(after),)
+    sql = "SELECT " + ', '.join(BIRTHDAY_COLUMNS) + ", id FROM birthdays"
+    return _encode(_chunks(sql, clauses, params, ('id',), position, limit), BIRTHDAY_COLUMNS, fmt)
@@ -0,0 +1,123 @@
+import struct
+import threading
+import time
+
+import numpy as np
+
+import renderer
+
+# Changed pixels are shipped as whole 8x8 blocks; every panel holds 8 of them
+BLOCK = 8
+# Send a full keyframe at least this often so a board that missed a delta recovers
+KEYFRAME_INTERVAL = 60
+
+# Delta wire format: header, then per changed block its (row, column) block
+# index as two big-endian u16 and one 8-byte 1bpp bitmap per colour plane
+DELTA_MAGIC = b'P10D'
+DELTA_HEADER = struct.Struct('>4sHHBH')  # magic, width, height, plane count, block count
+BLOCK_BYTES = 4 + renderer.PLANES * BLOCK
+
+
+def encode_delta(previous, frame):
+    """Return a delta packet turning previous into frame."""
+    height, width = frame.shape
+    rows, columns = height // BLOCK, width // BLOCK
+    blocks = frame.reshape(rows, BLOCK, columns, BLOCK).transpose(0, 2, 1, 3)
+    old_blocks = previous.reshape(rows, BLOCK, columns, BLOCK).transpose(0, 2, 1, 3)
+    dirty = (blocks != old_blocks).any(axis=(2, 3))
+    changed = blocks[dirty]  # (n, 8, 8)
+    coords = np.ascontiguousarray(np.argwhere(dirty), dtype='>u2').view(np.uint8).reshape(-1, 4)
+    planes = (changed[:, None] >> np.arange(renderer.PLANES, dtype=np.uint8).reshape(1, renderer.PLANES, 1, 1)) & 1
+    bitmaps = np.packbits(planes, axis=-1).reshape(-1, renderer.PLANES * BLOCK)
+    header = DELTA_HEADER.pack(DELTA_MAGIC, width, height, renderer.PLANES, len(changed))
+    return header + np.concatenate([coords, bitmaps], axis=1).tobytes()
+
+
+def apply_delta(frame, data):
+    """Apply a delta packet to a frame in place, for emulators and tests."""
+    magic, width, height, planes, count = DELTA_HEADER.unpack_from(data)
+    if magic != DELTA_MAGIC or frame.shape != (height, width):
+        raise ValueError('Delta does not match frame')
+    records = np.frombuffer(data, dtype=np.uint8, offset=DELTA_HEADER.size).reshape(count, BLOCK_BYTES)
+    coords = records[:, :4].copy().view('>u2').reshape(count, 2)
+    bits = np.unpackbits(records[:, 4:].reshape(count, planes, BLOCK, 1), axis=-1)  # (n, planes, 8, 8)
+    pixels = (bits << np.arange(planes, dtype=np.uint8).reshape(1, planes, 1, 1)).sum(axis=1, dtype=np.uint8)
+    blocks = frame.reshape(height // BLOCK, BLOCK, width // BLOCK, BLOCK).transpose(0, 2, 1, 3)
+    blocks[coords[:, 0], coords[:, 1]] = pixels
+    return frame
+
+
+class FrameStream:
+    """Remembers the last frame a board accepted and sends only what changed.
+
+    A keyframe goes out first, after a failed send or reconnect, when the
+    board size changes, every keyframe_interval frames, or whenever the
+    delta would not be smaller.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.last = None
+        self.since_keyframe = 0
+        self.generation = None
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.keyframes = 0
+        self.bytes_sent = 0
+        self.full_bytes = 0  # what every frame would have cost as a keyframe
+        self.encode_seconds = 0.0
+
+    def reset(self):
+        with self.lock:
+            self.last = None
+
+    def send(self, frame, deliver):
+        """Send frame as a keyframe or a delta against the last one the board accepted.
+
+        deliver(encode) must call encode(generation) once the board
+        connection it will use is known, and send the bytes it returns; a
+        connection other than the one the last frame went over gets a
+        keyframe, since the board lost its framebuffer with it.
+        """
+        with self.lock:
+            start = time.perf_counter()
+            keyframe = renderer.pack_frame(frame)
+            self.encode_seconds += time.perf_counter() - start
+            sent = {}
+
+            def encode(generation):
+                start = time.perf_counter()
+                payload, is_key = keyframe, True
+                if (self.last is not None and self.last.shape == frame.shape and generation == self.generation
+                        and self.since_keyframe < self.keyframe_interval):
+                    delta = encode_delta(self.last, frame)
+                    if len(delta) < len(keyframe):
+                        payload, is_key = delta, False
+                self.encode_seconds += time.perf_counter() - start
+                sent.update(payload=payload, is_key=is_key, generation=generation)
+                return payload
+
+            result = deliver(encode)
+            if not result.ok or not sent:
+                self.last = None
+                return result
+            self.last = frame.copy()
+            self.generation = sent['generation']
+            self.since_keyframe = 0 if sent['is_key'] else self.since_keyframe + 1
+            self.frames += 1
+            self.keyframes += sent['is_key']
+            self.bytes_sent += len(sent['payload'])
+            self.full_bytes += len(keyframe)
+            return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                'frames': self.frames,
+                'keyframes': self.keyframes,
+                'bytes_sent': self.bytes_sent,
+                'keyframe_bytes': self.full_bytes,
+                'savings': 1 - self.bytes_sent / self.full_bytes if self.full_bytes else 0.0,
+                'bytes_per_frame': self.bytes_sent / self.frames if self.frames else 0.0,
+                'encode_ms_per_frame': 1000 * self.encode_seconds / self.frames if self.frames else 0.0,
+            }
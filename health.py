@@ -0,0 +1,189 @@
+import random
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+import db
+import delivery
+
+# Healthy boards are probed this often; down boards back off up to MAX_INTERVAL
+PROBE_INTERVAL = 10.0
+MAX_INTERVAL = 60.0
+# Spread probes by +/- this fraction so boards are not all hit at once
+JITTER = 0.2
+PROBE_TIMEOUT = 2.0
+# Probes kept in memory per board, about an hour at the base interval
+HISTORY = 360
+# Probe rows kept in board_health
+HISTORY_DAYS = 7
+
+Probe = namedtuple('Probe', ['checked_at', 'online', 'latency', 'error'])
+
+
+def tcp_probe(ip, port, timeout=PROBE_TIMEOUT):
+    """Check that a board accepts TCP connections on its port."""
+    if not ip or not port:
+        return Probe(time.time(), False, 0.0, 'Board not configured')
+    start = time.perf_counter()
+    try:
+        socket.create_connection((ip, int(port)), timeout=timeout).close()
+    except (OSError, ValueError) as e:
+        return Probe(time.time(), False, time.perf_counter() - start, str(e) or type(e).__name__)
+    return Probe(time.time(), True, time.perf_counter() - start, None)
+
+
+class BoardHealth:
+    def __init__(self):
+        self.online = None  # unknown until the first probe or send
+        self.latency = None
+        self.error = None
+        self.checked_at = None
+        self.changed_at = None
+        self.failures = 0
+        self.next_probe = 0.0
+        self.history = deque(maxlen=HISTORY)
+
+
+class HealthMonitor:
+    """Probes every board in the background and keeps their status in memory.
+
+    boards() returns {board_id: (ip, port)} for the boards to watch.
+    Delivery outcomes reported through observe() update the status too,
+    so a board that stops accepting messages is marked down right away.
+    Probe results are written to board_health while persist() is true,
+    and on_change(board_id, online) is called when a board goes up or down.
+    """
+
+    def __init__(self, boards, probe=tcp_probe, interval=PROBE_INTERVAL, max_interval=MAX_INTERVAL, persist=None,
+                 on_change=None):
+        self.boards = boards
+        self.on_change = on_change
+        self.probe = probe
+        self.interval = interval
+        self.max_interval = max_interval
+        self.persist = persist
+        self.state = {}
+        self.cond = threading.Condition()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='board-health', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                delay = self.check_due()
+            except Exception as e:
+                print(f'Board health check failed: {e}')
+                delay = self.interval
+            self.wake.wait(delay)
+            self.wake.clear()
+
+    def check_now(self, board_id=None):
+        """Probe a board (or all of them) on the next pass instead of waiting."""
+        with self.cond:
+            for key, state in self.state.items():
+                if board_id is None or key == board_id:
+                    state.next_probe = 0.0
+        self.wake.set()
+
+    def check_due(self):
+        """Probe the boards that are due; returns seconds until the next one is."""
+        addresses = self.boards()
+        now = time.monotonic()
+        with self.cond:
+            for board_id in set(self.state) - set(addresses):
+                del self.state[board_id]
+            due = {board_id: address for board_id, address in addresses.items()
+                   if self.state.setdefault(board_id, BoardHealth()).next_probe <= now}
+        if due:
+            results = delivery.fan_out(lambda board_id: self.probe(*due[board_id]), due)
+            for board_id, probe in results.items():
+                self._update(board_id, probe.online, probe.latency, probe.error, probe)
+            if self.persist is None or self.persist():
+                self._save(results)
+        with self.cond:
+            if not self.state:
+                return self.interval
+            return max(0.0, min(state.next_probe for state in self.state.values()) - time.monotonic())
+
+    def _save(self, results):
+        with db.transaction() as c:
+            c.executemany("INSERT INTO board_health (board_id, checked_at, online, latency_ms, error) VALUES (?, ?, ?, ?, ?)",
+                          [(board_id, datetime.fromtimestamp(probe.checked_at).isoformat(), 1 if probe.online else 0,
+                            round(probe.latency * 1000, 3), probe.error) for board_id, probe in results.items()])
+
+    def observe(self, board_id, ok, latency, error=None):
+        """Fold the outcome of a real send into the board's status."""
+        self._update(board_id, ok, latency, error)
+
+    def _update(self, board_id, online, latency, error, probe=None):
+        with self.cond:
+            state = self.state.get(board_id)
+            if state is None:
+                state = self.state[board_id] = BoardHealth()
+            changed = state.online != online
+            if changed:
+                state.changed_at = time.time()
+                state.online = online
+                self.cond.notify_all()
+            state.latency = latency
+            state.error = error
+            state.failures = 0 if online else state.failures + 1
+            if probe is not None:
+                state.checked_at = probe.checked_at
+                state.history.append(probe)
+            if probe is not None or not online:
+                delay = self.interval if online else min(self.max_interval, self.interval * 2 ** (state.failures - 1))
+                state.next_probe = time.monotonic() + delay * random.uniform(1 - JITTER, 1 + JITTER)
+        if probe is None and not online:
+            self.wake.set()
+        if changed and self.on_change:
+            self.on_change(board_id, online)
+
+    def online(self):
+        """{board_id: online} for every board that has been checked."""
+        with self.cond:
+            return {board_id: state.online for board_id, state in self.state.items() if state.online is not None}
+
+    def is_down(self, board_id):
+        """True only for boards known to be offline; unknown boards get the benefit of the doubt."""
+        state = self.state.get(board_id)
+        return state is not None and state.online is False
+
+    def wait_online(self, board_id, timeout):
+        """Block until the board is not known to be down; returns False on timeout."""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.is_down(board_id), timeout)
+
+    def status(self, board_id):
+        with self.cond:
+            state = self.state.get(board_id)
+            if state is None:
+                return None
+            samples = len(state.history)
+            return {
+                'online': bool(state.online),
+                'checked': state.online is not None,
+                'latency_ms': round(state.latency * 1000, 3) if state.latency is not None else None,
+                'error': state.error,
+                'checked_at': datetime.fromtimestamp(state.checked_at).isoformat() if state.checked_at else None,
+                'since': datetime.fromtimestamp(state.changed_at).isoformat() if state.changed_at else None,
+                'uptime': sum(probe.online for probe in state.history) / samples if samples else None,
+                'samples': samples,
+            }
+
+
+def history(board_id, limit=100):
+    """Most recent stored probes for a board, newest first."""
+    return db.query("SELECT checked_at, online, latency_ms, error FROM board_health WHERE board_id=? ORDER BY checked_at DESC LIMIT ?",
+                    (board_id, limit))
+
+
+def prune(days=HISTORY_DAYS, now=None):
+    cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+    return db.execute("DELETE FROM board_health WHERE checked_at < ?", (cutoff,)).rowcount
@@ -0,0 +1,138 @@
+import csv
+import time
+from datetime import date, datetime
+
+from upcoming import birth_md
+
+BATCH_SIZE = 1000
+# Accepted spellings of a date of birth, tried in order
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%d.%m.%Y')
+NAME_COLUMN = 'Name'
+DOB_COLUMN = 'DateOfBirth'
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = []  # (row number, reason)
+        self.duplicate_rows = []  # row numbers, only filled by import_birthdays(detail=True)
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f'Imported {self.inserted} birthdays ({self.duplicates} duplicates skipped, '
+                f'{len(self.rejected)} rejected) in {self.elapsed:.2f}s, {self.rows_per_second:.0f} rows/s')
+
+
+def normalize_dob(value):
+    """Return a date of birth as YYYY-MM-DD, or None if it cannot be parsed."""
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        parsed = value
+    elif isinstance(value, str):
+        value = value.strip()
+        # Spreadsheet exports often append a midnight time component
+        value = value.split(' ')[0].split('T')[0]
+        for fmt in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt).date()
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    else:
+        return None
+    if parsed > date.today():
+        return None
+    return parsed.isoformat()
+
+
+def iter_csv(path):
+    """Yield (row number, name, dob) from a CSV file one row at a time."""
+    with open(path, newline='', encoding='utf-8-sig') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for number, row in enumerate(reader, start=2):
+            yield number, row.get(NAME_COLUMN), row.get(DOB_COLUMN)
+
+
+def iter_xlsx(path):
+    """Yield (row number, name, dob) from the first sheet of an XLSX file without loading it whole."""
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        if NAME_COLUMN not in header or DOB_COLUMN not in header:
+            return
+        name_index = header.index(NAME_COLUMN)
+        dob_index = header.index(DOB_COLUMN)
+        for number, row in enumerate(rows, start=2):
+            name = row[name_index] if name_index < len(row) else None
+            dob = row[dob_index] if dob_index < len(row) else None
+            yield number, name, dob
+    finally:
+        workbook.close()
+
+
+def import_birthdays(conn, rows, batch_size=BATCH_SIZE, detail=False):
+    """Validate rows and insert the new ones in a single transaction.
+
+    Rows are staged in batches with executemany and then merged into
+    birthdays, skipping (name, dob) pairs that already exist. With
+    detail=True the report also lists which rows were duplicates.
+    """
+    report = ImportReport()
+    start = time.perf_counter()
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS birthday_import (number INTEGER, name TEXT, dob TEXT, birth_md INTEGER)")
+    c.execute("DELETE FROM birthday_import")
+    batch = []
+    seen = set()
+    duplicates = set()
+    try:
+        for number, name, dob in rows:
+            report.read += 1
+            name = str(name).strip() if name is not None else ''
+            if not name:
+                report.rejected.append((number, 'missing name'))
+                continue
+            normalized = normalize_dob(dob)
+            if normalized is None:
+                report.rejected.append((number, f'invalid date of birth: {dob!r}'))
+                continue
+            if detail:
+                if (name, normalized) in seen:
+                    duplicates.add(number)
+                seen.add((name, normalized))
+            batch.append((number, name, normalized, birth_md(normalized)))
+            if len(batch) >= batch_size:
+                c.executemany("INSERT INTO birthday_import (number, name, dob, birth_md) VALUES (?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            c.executemany("INSERT INTO birthday_import (number, name, dob, birth_md) VALUES (?, ?, ?, ?)", batch)
+        if detail:
+            c.execute('''SELECT i.number FROM birthday_import i
+                         JOIN birthdays b ON b.name = i.name AND b.dob = i.dob''')
+            duplicates.update(number for number, in c.fetchall())
+            report.duplicate_rows = sorted(duplicates)
+        c.execute("SELECT COUNT(*) FROM birthday_import")
+        staged = c.fetchone()[0]
+        c.execute('''INSERT INTO birthdays (name, dob, birth_md)
+                     SELECT DISTINCT name, dob, birth_md FROM birthday_import i
+                     WHERE NOT EXISTS (SELECT 1 FROM birthdays b WHERE b.name = i.name AND b.dob = i.dob)''')
+        report.inserted = c.rowcount
+        report.duplicates = staged - report.inserted
+        c.execute("DELETE FROM birthday_import")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    report.elapsed = time.perf_counter() - start
+    return report
@@ -0,0 +1,85 @@
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+
+import db
+
+# A leader that misses heartbeats for LEASE_TTL seconds is replaced
+LEASE_TTL = 15.0
+HEARTBEAT = 5.0
+
+
+class LeaderElection:
+    """Elects one process to run scheduled jobs through a lease row in SQLite.
+
+    Every process heartbeats the `leases` row for `name`. The holder
+    renews it; anyone else takes it over once it has expired. Becoming
+    leader calls on_elected(), losing the lease calls on_demoted().
+    """
+
+    def __init__(self, name, on_elected=None, on_demoted=None, ttl=LEASE_TTL, heartbeat=HEARTBEAT):
+        self.name = name
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.leader = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def try_acquire(self):
+        """Take or renew the lease; returns whether this process holds it."""
+        now = time.time()
+        cursor = db.execute('''INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                               ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+                               WHERE leases.owner=excluded.owner OR leases.expires_at < ?''',
+                            (self.name, self.owner, now + self.ttl, now))
+        return cursor.rowcount == 1
+
+    def tick(self):
+        try:
+            leader = self.try_acquire()
+        except Exception as e:
+            # Without a renewal the lease may already be someone else's
+            print(f'Lease heartbeat failed: {e}')
+            leader = False
+        if leader and not self.leader:
+            self.leader = True
+            if self.on_elected:
+                self.on_elected()
+        elif not leader and self.leader:
+            self.leader = False
+            if self.on_demoted:
+                self.on_demoted()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.tick()
+            self.stopped.wait(self.heartbeat)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f'lease-{self.name}', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop heartbeating and hand the lease over immediately."""
+        self.stopped.set()
+        if self.leader:
+            self.leader = False
+            if self.on_demoted:
+                self.on_demoted()
+            db.execute("UPDATE leases SET expires_at=0 WHERE name=? AND owner=?", (self.name, self.owner))
+
+    def status(self):
+        row = db.query_one("SELECT owner, expires_at FROM leases WHERE name=?", (self.name,))
+        return {
+            'owner': self.owner,
+            'leader': self.leader,
+            'holder': row[0] if row else None,
+            'expires_in': max(0.0, row[1] - time.time()) if row else None,
+        }
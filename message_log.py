@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+
+import db
+import delivery
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MESSAGE_TYPES = ('custom', 'birthday', 'news', 'program', 'quick_message', 'broadcast', 'scheduled')
+# Messages older than this are folded into message_daily_counts
+RETENTION_DAYS = 90
+# A message still queued or sending this long after it was logged has lost
+# the process that held it; live workers finalize theirs within the hold time
+STALE_SECONDS = 2 * delivery.HOLD_TIMEOUT
+# message_changes rows read per poll, and how many are kept for processes catching up
+CHANGE_BATCH = 1000
+CHANGE_LOG_ROWS = 10000
+
+
+def encode_cursor(timestamp, message_id):
+    return f'{timestamp}~{message_id}'
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) from a page cursor, or None if it is malformed."""
+    timestamp, _, message_id = (cursor or '').rpartition('~')
+    if not timestamp or not message_id.isdigit():
+        return None
+    return timestamp, int(message_id)
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+    terms = text.split()
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def page(before=None, limit=PAGE_SIZE, search=None, msg_type=None):
+    """Return (rows, next_cursor) for one page of the log, newest first.
+
+    Pages are keyed on (timestamp, id) so each page is an index range scan
+    no matter how deep the reader has paged.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    clauses, params = [], []
+    sql = "SELECT m.id, m.message, m.timestamp, m.type, m.status, m.board_id FROM messages m"
+    if search and search.strip():
+        sql += " JOIN messages_fts ON messages_fts.rowid = m.id"
+        clauses.append("messages_fts MATCH ?")
+        params.append(fts_query(search))
+    if msg_type:
+        clauses.append("m.type = ?")
+        params.append(msg_type)
+    position = decode_cursor(before)
+    if position:
+        clauses.append("(m.timestamp, m.id) < (?, ?)")
+        params.extend(position)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY m.timestamp DESC, m.id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = [{'id': row[0], 'message': row[1], 'timestamp': row[2], 'type': row[3], 'status': row[4], 'board_id': row[5]}
+            for row in db.query(sql, params)]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def counts_by_type():
+    """Totals per type across live rows and rolled-up history, from the trigger-kept counts table."""
+    return {msg_type: count for msg_type, count in
+            db.query("SELECT type, live + archived FROM message_type_counts WHERE live + archived > 0")}
+
+
+def rollup(days=RETENTION_DAYS, now=None):
+    """Fold messages older than `days` into daily counts and delete them.
+
+    Rows still waiting on delivery are left alone. Returns rows removed.
+    """
+    cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+    with db.transaction() as c:
+        c.execute('''INSERT INTO message_daily_counts (day, type, count)
+                     SELECT substr(timestamp, 1, 10), COALESCE(type, ''), COUNT(*) FROM messages
+                     WHERE timestamp < ? AND COALESCE(status, '') NOT IN ('queued', 'sending')
+                     GROUP BY 1, 2
+                     ON CONFLICT (day, type) DO UPDATE SET count = count + excluded.count''', (cutoff,))
+        c.execute('''INSERT INTO message_type_counts (type, archived)
+                     SELECT COALESCE(type, ''), COUNT(*) FROM messages
+                     WHERE timestamp < ? AND COALESCE(status, '') NOT IN ('queued', 'sending')
+                     GROUP BY 1
+                     ON CONFLICT (type) DO UPDATE SET archived = archived + excluded.archived''', (cutoff,))
+        c.execute("DELETE FROM messages WHERE timestamp < ? AND COALESCE(status, '') NOT IN ('queued', 'sending')",
+                  (cutoff,))
+        return c.rowcount
+
+
+def last_change():
+    return db.query_one("SELECT COALESCE(MAX(seq), 0) FROM message_changes")[0]
+
+
+def changes(after, limit=CHANGE_BATCH):
+    """Return (cursor, [(topic, data)]) for messages logged or re-statused after cursor `after`.
+
+    Rows are read as they are now, so a message that moved several times
+    since the last poll yields one event with its latest status. New
+    messages come as one 'message' event (a batch carries its newest
+    PAGE_SIZE rows and the total count); status changes sharing an outcome
+    come as one 'delivery' event with their ids.
+    """
+    rows = db.query("""SELECT c.seq, c.topic, m.id, m.message, m.timestamp, m.type, m.status, m.board_id,
+                               m.attempts, m.error, m.delivered_at
+                        FROM message_changes c LEFT JOIN messages m ON m.id = c.message_id
+                        WHERE c.seq > ? ORDER BY c.seq LIMIT ?""", (after, limit))
+    if not rows:
+        return after, []
+    logged = {}
+    outcomes = {}
+    for _, topic, message_id, message, timestamp, msg_type, status, board_id, attempts, error, delivered_at in rows:
+        if message_id is None:
+            continue  # already rolled up
+        if topic == 'message':
+            logged[message_id] = {'id': message_id, 'message': message, 'timestamp': timestamp, 'type': msg_type,
+                                  'status': status, 'board_id': board_id}
+        elif message_id not in logged:
+            outcomes[message_id] = (status, attempts, error, delivered_at)
+    found = []
+    if len(logged) == 1:
+        found.append(('message', *logged.values()))
+    elif logged:
+        found.append(('message', {'count': len(logged), 'messages': list(logged.values())[-PAGE_SIZE:]}))
+    groups = {}
+    for message_id, outcome in outcomes.items():
+        groups.setdefault(outcome, []).append(message_id)
+    for (status, attempts, error, delivered_at), ids in groups.items():
+        data = {'id': ids[0]} if len(ids) == 1 else {'ids': ids}
+        found.append(('delivery', {**data, 'status': status, 'attempts': attempts, 'error': error,
+                                   'delivered_at': delivered_at}))
+    return rows[-1][0], found
+
+
+def prune_changes(keep=CHANGE_LOG_ROWS):
+    """Drop all but the newest `keep` message_changes rows; returns rows removed."""
+    return db.execute("DELETE FROM message_changes WHERE seq <= (SELECT MAX(seq) FROM message_changes) - ?",
+                      (keep,)).rowcount
+
+
+def fail_stale(seconds=STALE_SECONDS, now=None):
+    """Mark messages left queued or sending by a process that exited as failed.
+
+    Delivery queues live in memory, so those rows would otherwise never
+    be finalized, and rollup() never folds them. Returns rows updated.
+    """
+    now = now or datetime.now()
+    cutoff = (now - timedelta(seconds=seconds)).isoformat()
+    return db.execute("""UPDATE messages SET status = 'failed', error = 'Not delivered before the server stopped',
+                         delivered_at = ? WHERE timestamp < ? AND status IN ('queued', 'sending')""",
+                      (now.isoformat(), cutoff)).rowcount
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from collections import deque
+from itertools import islice
+from datetime import datetime
+
+import requests
+
+import db
+import metrics
+from ai_messages import GROQ_SECONDS
+
+NEWS_API_URL = 'https://newsapi.org/v2/top-headlines'
+MODEL = "llama3-8b-8192"
+# Fetched headlines are reused for this long before NewsAPI is asked again
+CACHE_TTL = 15 * 60
+# Fresh headlines from the current feed kept ready for the board
+QUEUE_SIZE = 10
+TIMEOUT = (3, 10)
+
+NEWS_API_SECONDS = metrics.Histogram('ledboard_newsapi_request_seconds', 'NewsAPI request latency.', ('status',))
+
+
+def headline_hash(title):
+    return hashlib.sha256(' '.join(title.split()).lower().encode()).hexdigest()
+
+
+class NewsPipeline:
+    """Fetches top headlines, skips ones already shown and serves fresh
+    ones in rotation, with cached AI summaries.
+
+    Responses are cached for CACHE_TTL; after that the request is
+    conditional (ETag / Last-Modified) so an unchanged feed costs a 304.
+    """
+
+    def __init__(self, api_key, base_url=NEWS_API_URL, country='us', ttl=CACHE_TTL, queue_size=QUEUE_SIZE):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.country = country
+        self.ttl = ttl
+        self.session = requests.Session()
+        self.articles = []
+        self.fetched_at = None
+        self.etag = None
+        self.last_modified = None
+        self.queue = deque(maxlen=queue_size)
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        """Return the latest article list, from cache while it is fresh."""
+        if self.fetched_at is not None and time.monotonic() - self.fetched_at < self.ttl:
+            return self.articles
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url, params={'country': self.country, 'apiKey': self.api_key},
+                                        headers=headers, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            NEWS_API_SECONDS.observe(time.perf_counter() - start, 'error')
+            print(f'News fetch failed: {e}')
+            return self.articles
+        NEWS_API_SECONDS.observe(time.perf_counter() - start, response.status_code)
+        if response.status_code == 200:
+            self.articles = response.json().get('articles') or []
+            self.etag = response.headers.get('ETag')
+            self.last_modified = response.headers.get('Last-Modified')
+        elif response.status_code != 304:
+            print(f'News fetch returned {response.status_code}')
+            return self.articles
+        self.fetched_at = time.monotonic()
+        return self.articles
+
+    def refill(self):
+        """Rebuild the queue from the current feed: its unshown headlines, in feed order.
+
+        Headlines that dropped out of the feed leave the queue, so a slot
+        never shows a story from an old fetch.
+        """
+        titles = {}
+        for article in self.fetch():
+            title = (article.get('title') or '').strip()
+            if title:
+                titles.setdefault(headline_hash(title), title)
+        self.queue.clear()
+        if not titles:
+            return
+        placeholders = ','.join('?' * len(titles))
+        shown = {row[0] for row in db.query(
+            f"SELECT hash FROM news_headlines WHERE shown_at IS NOT NULL AND hash IN ({placeholders})", list(titles))}
+        now = datetime.now().isoformat()
+        with db.transaction() as c:
+            c.executemany("INSERT OR IGNORE INTO news_headlines (hash, title, first_seen) VALUES (?, ?, ?)",
+                          [(key, title, now) for key, title in titles.items()])
+        self.queue.extend(islice((title for key, title in titles.items() if key not in shown), self.queue.maxlen))
+
+    def next_headline(self):
+        """Pop the next fresh headline and mark it shown, or None if there is nothing new."""
+        with self.lock:
+            # fetch() is cached for the TTL, so this only costs a request once the feed may have moved on
+            self.refill()
+            if not self.queue:
+                return None
+            title = self.queue.popleft()
+        db.execute("UPDATE news_headlines SET shown_at=? WHERE hash=?", (datetime.now().isoformat(), headline_hash(title)))
+        return title
+
+    def summarize(self, title, language, client):
+        """AI rephrasing of a headline, cached per headline and language."""
+        if not client:
+            return title
+        key = headline_hash(title)
+        row = db.query_one("SELECT summary FROM news_summaries WHERE hash=? AND language=?", (key, language))
+        if row:
+            return row[0]
+        prompt = f"Summarize and rephrase this news headline in {language}: {title}"
+        start = time.perf_counter()
+        try:
+            ai_response = client.chat.completions.create(
+                model=MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=100
+            )
+            summary = ai_response.choices[0].message.content.strip()
+        except Exception as e:
+            GROQ_SECONDS.observe(time.perf_counter() - start, 'news_summary', 'error')
+            print(f'News summary failed: {e}')
+            return title
+        GROQ_SECONDS.observe(time.perf_counter() - start, 'news_summary', 'ok')
+        db.execute("INSERT OR REPLACE INTO news_summaries (hash, language, summary, created_at) VALUES (?, ?, ?, ?)",
+                   (key, language, summary, datetime.now().isoformat()))
+        return summary
+
+    def next_item(self, language, client=None):
+        """Text for the board's next news slot, or None."""
+        title = self.next_headline()
+        if title is None:
+            return None
+        return self.summarize(title, language, client)
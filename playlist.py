@@ -0,0 +1,271 @@
+import heapq
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db
+
+# Shortest time a playlist item stays on a board
+MIN_DWELL = 1.0
+# Boards sent to at once; each board still gets its payloads in order
+SEND_WORKERS = 16
+# Longest the engine sleeps before checking whether playlists changed
+CHECK_INTERVAL = 5.0
+# Clocks are redrawn this long after the minute turns, so the new minute is showing
+TICK_SLACK = 0.05
+
+Item = namedtuple('Item', ['program', 'dwell'])
+
+
+class CompiledProgram:
+    """A program prepared once for one board geometry.
+
+    Static widgets are rasterized into a base frame up front; clocks are
+    the only dynamic widgets and are drawn onto a copy of it when their
+    text changes. Text-only boards get the flattened program text.
+    Payloads are shared between boards and must not be modified.
+    """
+
+    def __init__(self, widgets, width, height, frames, default_color, default_font_size):
+        import renderer  # numpy is only loaded once a playlist is in use
+        self.widgets = widgets
+        self.frames = frames
+        self.clocks = [widget for widget in widgets if widget.get('type') == 'clock']
+        self.default_color = default_color
+        self.default_font_size = default_font_size
+        self.base = None
+        if frames:
+            static = [widget for widget in widgets if widget.get('type') != 'clock']
+            self.base = renderer.render_program(static, width, height, default_color, default_font_size)
+            self.base.setflags(write=False)
+        self.key = None
+        self.payload_cache = None
+
+    @property
+    def dynamic(self):
+        return bool(self.clocks)
+
+    def payload(self, now):
+        """Display payload at `now`; the same object is returned until a clock changes."""
+        import renderer
+        key = tuple(renderer.widget_text(clock, now) for clock in self.clocks)
+        if key == self.key and self.payload_cache is not None:
+            return self.payload_cache
+        if not self.frames:
+            payload = renderer.program_text(self.widgets, now)
+        elif not self.clocks:
+            payload = self.base
+        else:
+            payload = self.base.copy()
+            for clock, text in zip(self.clocks, key):
+                properties = clock.get('properties', {})
+                renderer.blit(payload, renderer.text_bitmap(text, renderer.font_scale(properties.get('fontSize', self.default_font_size))),
+                              clock.get('x', 0), clock.get('y', 0), renderer.parse_color(properties.get('color', self.default_color)))
+            payload.setflags(write=False)
+        self.key, self.payload_cache = key, payload
+        return payload
+
+    @staticmethod
+    def next_tick(now):
+        """Seconds until clocks next change (they show minutes)."""
+        return 60 - now.second - now.microsecond / 1e6 + TICK_SLACK
+
+
+class BoardState:
+    def __init__(self, board_id, items):
+        self.board_id = board_id
+        self.items = items
+        self.index = -1
+        self.item_until = 0.0
+        self.last_payload = None
+        self.outgoing = None
+        self.sending = False
+
+
+class PlaylistEngine:
+    """Cycles each board's playlist from one thread.
+
+    Boards wait in a heap keyed by when they next need attention: the end
+    of the current item's dwell, or the next clock tick. Programs are
+    compiled once per geometry and shared by every board showing them, so
+    a clock tick costs one redraw however many boards display it.
+    settings() returns the settings_cache snapshot (boards and display
+    defaults); send(board_id, payload) delivers a frame or text.
+    """
+
+    def __init__(self, settings, send, send_workers=SEND_WORKERS):
+        self.settings = settings
+        self.send = send
+        self.pool = ThreadPoolExecutor(max_workers=send_workers, thread_name_prefix='playlist')
+        self.lock = threading.Lock()
+        self.boards = {}
+        self.heap = []
+        self.compiled = {}
+        self.version = None
+        self.stopped = threading.Event()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped = threading.Event()
+        self.version = None
+        self.thread = threading.Thread(target=self.run, args=(self.stopped,), name='playlist', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    def reload(self):
+        """Pick up playlist changes right away instead of on the next version check."""
+        self.version = None
+        self.wake.set()
+
+    def run(self, stopped):
+        while not stopped.is_set():
+            try:
+                delay = self.step()
+            except Exception as e:
+                print(f'Playlist engine failed: {e}')
+                delay = CHECK_INTERVAL
+            self.wake.wait(min(delay, CHECK_INTERVAL))
+            self.wake.clear()
+
+    def step(self):
+        """Reload if boards or playlists changed and serve every board that is due; returns seconds until the next one."""
+        current = self.settings()
+        # Board assignments move the settings version, playlist edits their own
+        version = (current.version, db.data_version('playlists'))
+        if version != self.version:
+            self._load(current)
+            self.version = version
+        now = time.monotonic()
+        wall = datetime.now()
+        while self.heap and self.heap[0][0] <= now:
+            _, board_id = heapq.heappop(self.heap)
+            state = self.boards.get(board_id)
+            if state is not None:
+                heapq.heappush(self.heap, (self._serve(state, now, wall), board_id))
+        return self.heap[0][0] - time.monotonic() if self.heap else CHECK_INTERVAL
+
+    def _serve(self, state, now, wall):
+        if now >= state.item_until:
+            state.index = (state.index + 1) % len(state.items)
+            state.item_until = now + state.items[state.index].dwell
+        program = state.items[state.index].program
+        payload = program.payload(wall)
+        if payload is not state.last_payload:
+            state.last_payload = payload
+            self._dispatch(state, payload)
+        if program.dynamic:
+            return min(state.item_until, now + program.next_tick(wall))
+        return state.item_until
+
+    def _dispatch(self, state, payload):
+        # Only the newest payload matters; a board still busy with the previous one gets it next
+        with self.lock:
+            state.outgoing = payload
+            if state.sending:
+                return
+            state.sending = True
+        self.pool.submit(self._drain, state)
+
+    def _drain(self, state):
+        while True:
+            with self.lock:
+                payload, state.outgoing = state.outgoing, None
+                if payload is None:
+                    state.sending = False
+                    return
+            try:
+                self.send(state.board_id, payload)
+            except Exception as e:
+                print(f'Playlist send to board {state.board_id} failed: {e}')
+
+    def _load(self, current):
+        rows = db.query('''SELECT b.id, p.id, p.widgets, p.updated_at, i.dwell
+                           FROM boards b
+                           JOIN playlists pl ON pl.id = b.playlist_id AND pl.active = 1
+                           JOIN playlist_items i ON i.playlist_id = pl.id
+                           JOIN programs p ON p.id = i.program_id
+                           WHERE b.active = 1
+                           ORDER BY b.id, i.position, i.id''')
+        color, font_size = current.display[8], current.display[7]
+        compiled = {}
+        items = {}
+        for board_id, program_id, widgets, updated_at, dwell in rows:
+            board = current.board(board_id)
+            key = (program_id, updated_at, board.width, board.height, bool(board.frames), color, font_size)
+            program = compiled.get(key) or self.compiled.get(key)
+            if program is None:
+                try:
+                    program = CompiledProgram(json.loads(widgets), board.width, board.height, bool(board.frames),
+                                              color, font_size)
+                except ValueError as e:
+                    print(f'Program {program_id} cannot be shown on board {board_id}: {e}')
+                    continue
+            compiled[key] = program
+            items.setdefault(board_id, []).append(Item(program, max(MIN_DWELL, dwell)))
+        self.compiled = compiled
+        now = time.monotonic()
+        boards = {}
+        for board_id, board_items in items.items():
+            state = self.boards.get(board_id)
+            if state is None or [item.program for item in state.items] != [item.program for item in board_items]:
+                state = BoardState(board_id, board_items)
+            else:
+                state.items = board_items  # same programs, maybe new dwell times: keep the position
+            boards[board_id] = state
+        self.boards = boards
+        # Everyone is served once now; boards that kept their position just reschedule
+        self.heap = [(now, board_id) for board_id in boards]
+        heapq.heapify(self.heap)
+
+    def status(self):
+        boards = self.boards
+        now = time.monotonic()
+        return {board_id: {'item': state.index, 'items': len(state.items),
+                           'remaining': max(0.0, state.item_until - now) if state.index >= 0 else None}
+                for board_id, state in boards.items()}
+
+
+# Storage helpers for the API
+
+def save_program(name, widgets, program_id=None):
+    """Create or replace a program; returns its id, or None if program_id does not exist."""
+    now = datetime.now().isoformat()
+    if program_id is None:
+        return db.execute("INSERT INTO programs (name, widgets, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                          (name, json.dumps(widgets), now, now)).lastrowid
+    found = db.execute("UPDATE programs SET name=?, widgets=?, updated_at=? WHERE id=?",
+                       (name, json.dumps(widgets), now, program_id)).rowcount
+    return program_id if found else None
+
+
+def save_playlist(name, items, active=True, playlist_id=None):
+    """Create or replace a playlist and its items [(program_id, dwell)]; returns its id or None."""
+    with db.transaction() as c:
+        if playlist_id is None:
+            playlist_id = c.execute("INSERT INTO playlists (name, active) VALUES (?, ?)",
+                                    (name, 1 if active else 0)).lastrowid
+        elif not c.execute("UPDATE playlists SET name=?, active=? WHERE id=?",
+                           (name, 1 if active else 0, playlist_id)).rowcount:
+            return None
+        c.execute("DELETE FROM playlist_items WHERE playlist_id=?", (playlist_id,))
+        c.executemany("INSERT INTO playlist_items (playlist_id, program_id, position, dwell) VALUES (?, ?, ?, ?)",
+                      [(playlist_id, program_id, position, dwell) for position, (program_id, dwell) in enumerate(items)])
+    return playlist_id
+
+
+def list_playlists():
+    items = {}
+    for playlist_id, program_id, dwell in db.query(
+            "SELECT playlist_id, program_id, dwell FROM playlist_items ORDER BY playlist_id, position, id"):
+        items.setdefault(playlist_id, []).append({'program_id': program_id, 'dwell': dwell})
+    return [{'id': row[0], 'name': row[1], 'active': bool(row[2]), 'items': items.get(row[0], [])}
+            for row in db.query("SELECT id, name, active FROM playlists ORDER BY id")]
@@ -0,0 +1,171 @@
+import struct
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+# P10 panels are 32x16 and chained left to right, then top to bottom
+PANEL_WIDTH = 32
+PANEL_HEIGHT = 16
+
+# Pixels hold a 3-bit colour: bit 0 red, bit 1 green, bit 2 blue
+RED, GREEN, BLUE = 1, 2, 4
+COLORS = {
+    'white': RED | GREEN | BLUE, 'red': RED, 'green': GREEN, 'blue': BLUE,
+    'yellow': RED | GREEN, 'cyan': GREEN | BLUE, 'magenta': RED | BLUE,
+}
+DEFAULT_COLOR = 'red'
+
+# Frame wire format: header, then one 1bpp plane per colour bit with the
+# pixels of each panel contiguous, in chain order
+FRAME_MAGIC = b'P10F'
+FRAME_HEADER = struct.Struct('>4sHHB')  # magic, width, height, plane count
+PLANES = 3
+
+# Classic 5x7 font, ASCII 32-126, five column bytes per glyph (bit 0 = top row)
+FONT_5X7 = bytes.fromhex(
+    '0000000000' '00005f0000' '0007000700' '147f147f14' '242a7f2a12' '2313086462' '3649552250' '0005030000'
+    '001c224100' '0041221c00' '082a1c2a08' '08083e0808' '0050300000' '0808080808' '0060600000' '2010080402'
+    '3e5149453e' '00427f4000' '4261514946' '2141454b31' '1814127f10' '2745454539' '3c4a494930' '0171090503'
+    '3649494936' '064949291e' '0036360000' '0056360000' '0814224100' '1414141414' '0041221408' '0201510906'
+    '3249794136' '7e1111117e' '7f49494936' '3e41414122' '7f4141221c' '7f49494941' '7f09090101' '3e41415132'
+    '7f0808087f' '00417f4100' '2040413f01' '7f08142241' '7f40404040' '7f0204027f' '7f0408107f' '3e4141413e'
+    '7f09090906' '3e4151215e' '7f09192946' '4649494931' '01017f0101' '3f4040403f' '1f2040201f' '7f2018207f'
+    '6314081463' '0304780403' '6151494543' '007f414100' '0204081020' '0041417f00' '0402010204' '4040404040'
+    '0001020400' '2054545478' '7f48444438' '3844444420' '384444487f' '3854545418' '087e090102' '081454543c'
+    '7f08040478' '00447d4000' '2040443d00' '007f102844' '00417f4000' '7c04180478' '7c08040478' '3844444438'
+    '7c14141408' '081414187c' '7c08040408' '4854545420' '043f444020' '3c4040207c' '1c2040201c' '3c4030403c'
+    '4428102844' '0c5050503c' '4464544c44' '0008364100' '00007f0000' '0041360800' '0201020402'
+)
+FIRST_CHAR = 32
+GLYPH_COUNT = len(FONT_5X7) // 5
+UNKNOWN_GLYPH = ord('?') - FIRST_CHAR
+CELL_WIDTH = 6   # 5 columns plus one column of spacing
+CELL_HEIGHT = 8  # 7 rows plus one row of spacing
+
+
+def parse_color(value):
+    """Map a colour name or #rrggbb string to a 3-bit pixel value."""
+    if not value:
+        return COLORS[DEFAULT_COLOR]
+    value = str(value).strip().lower()
+    if value in COLORS:
+        return COLORS[value]
+    if value.startswith('#') and len(value) == 7:
+        try:
+            r, g, b = (int(value[i:i + 2], 16) for i in (1, 3, 5))
+        except ValueError:
+            return COLORS[DEFAULT_COLOR]
+        color = (RED if r >= 128 else 0) | (GREEN if g >= 128 else 0) | (BLUE if b >= 128 else 0)
+        return color or COLORS[DEFAULT_COLOR]
+    return COLORS[DEFAULT_COLOR]
+
+
+def font_scale(font_size):
+    """Integer glyph magnification for an editor font size (8-32px)."""
+    return max(1, (int(font_size or 8) + 4) // CELL_HEIGHT)
+
+
+@lru_cache(maxsize=8)
+def glyph_atlas(scale):
+    """Boolean array (glyph, row, column) of every glyph at a given scale."""
+    columns = np.frombuffer(FONT_5X7, dtype=np.uint8).reshape(GLYPH_COUNT, 5)
+    rows = (columns[:, None, :] >> np.arange(7, dtype=np.uint8)[None, :, None]) & 1  # (glyph, 7, 5)
+    cells = np.zeros((GLYPH_COUNT, CELL_HEIGHT, CELL_WIDTH), dtype=bool)
+    cells[:, :7, :5] = rows.astype(bool)
+    if scale > 1:
+        cells = cells.repeat(scale, axis=1).repeat(scale, axis=2)
+    cells.setflags(write=False)
+    return cells
+
+
+@lru_cache(maxsize=1024)
+def text_bitmap(text, scale):
+    """Boolean bitmap of a line of text, glyphs side by side."""
+    codes = np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8).astype(np.intp) - FIRST_CHAR
+    codes[(codes < 0) | (codes >= GLYPH_COUNT)] = UNKNOWN_GLYPH
+    glyphs = glyph_atlas(scale)[codes]  # (n, h, w)
+    n, height, width = glyphs.shape
+    bitmap = glyphs.transpose(1, 0, 2).reshape(height, n * width)
+    bitmap.setflags(write=False)
+    return bitmap
+
+
+def blank_frame(width, height):
+    if width % PANEL_WIDTH or height % PANEL_HEIGHT:
+        raise ValueError(f'Board size {width}x{height} is not a whole number of {PANEL_WIDTH}x{PANEL_HEIGHT} panels')
+    return np.zeros((height, width), dtype=np.uint8)
+
+
+def blit(frame, bitmap, x, y, color):
+    """Draw a boolean bitmap onto the frame at (x, y), clipped to the frame."""
+    height, width = frame.shape
+    x, y = int(x), int(y)
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + bitmap.shape[1], width), min(y + bitmap.shape[0], height)
+    if left >= right or top >= bottom:
+        return
+    mask = bitmap[top - y:bottom - y, left - x:right - x]
+    region = frame[top:bottom, left:right]
+    region[mask] = color
+
+
+def widget_text(widget, now=None):
+    properties = widget.get('properties', {})
+    if widget.get('type') == 'clock':
+        now = now or datetime.now()
+        return now.strftime('%I:%M %p') if properties.get('format') == '12h' else now.strftime('%H:%M')
+    return str(properties.get('text', ''))
+
+
+def program_text(widgets, now=None):
+    """Flatten editor widgets into a single display message for text-only boards."""
+    parts = [widget_text(widget, now) for widget in widgets if widget.get('type') in ('text', 'clock')]
+    return ' | '.join(parts) if parts else 'Program Active'
+
+
+def render_program(widgets, width, height, default_color=DEFAULT_COLOR, default_font_size=16, now=None):
+    """Rasterize editor widgets into a (height, width) frame of colour values."""
+    frame = blank_frame(width, height)
+    for widget in widgets:
+        properties = widget.get('properties', {})
+        scale = font_scale(properties.get('fontSize', default_font_size))
+        color = parse_color(properties.get('color', default_color))
+        blit(frame, text_bitmap(widget_text(widget, now), scale), widget.get('x', 0), widget.get('y', 0), color)
+    return frame
+
+
+def pack_frame(frame):
+    """Serialize a frame as header plus per-panel 1bpp colour planes."""
+    height, width = frame.shape
+    panels = frame.reshape(height // PANEL_HEIGHT, PANEL_HEIGHT, width // PANEL_WIDTH, PANEL_WIDTH).transpose(0, 2, 1, 3)
+    planes = (panels[None] >> np.arange(PLANES, dtype=np.uint8).reshape(PLANES, 1, 1, 1, 1)) & 1
+    return FRAME_HEADER.pack(FRAME_MAGIC, width, height, PLANES) + np.packbits(planes, axis=-1).tobytes()
+
+
+def unpack_frame(data):
+    """Inverse of pack_frame, for emulators and tests."""
+    magic, width, height, planes = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError('Not a P10 frame')
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=FRAME_HEADER.size))
+    bits = bits.reshape(planes, height // PANEL_HEIGHT, width // PANEL_WIDTH, PANEL_HEIGHT, PANEL_WIDTH)
+    panels = (bits << np.arange(planes, dtype=np.uint8).reshape(planes, 1, 1, 1, 1)).sum(axis=0, dtype=np.uint8)
+    return panels.transpose(0, 2, 1, 3).reshape(height, width)
+
+
+def benchmark(frames=5000, width=96, height=16):
+    """Render and pack a text-plus-clock program repeatedly; returns frames per second."""
+    widgets = [
+        {'type': 'text', 'x': 0, 'y': 0, 'properties': {'text': 'Happy Birthday!', 'fontSize': 8, 'color': '#FF0000'}},
+        {'type': 'clock', 'x': 60, 'y': 8, 'properties': {'format': '24h'}},
+    ]
+    start = time.perf_counter()
+    for _ in range(frames):
+        pack_frame(render_program(widgets, width, height))
+    return frames / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    print(f'{benchmark():.0f} frames/s')
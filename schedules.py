@@ -0,0 +1,94 @@
+import db
+
+
+def parse_time(value):
+    """Normalize an 'H:MM' time of day to 'HH:MM'; raises ValueError if invalid."""
+    hour, _, minute = str(value).strip().partition(':')
+    hour, minute = int(hour), int(minute)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f'Invalid time: {value}')
+    return f'{hour:02d}:{minute:02d}'
+
+
+class ScheduleSlots:
+    """Runs user schedules from the schedules table with one cron job per time slot.
+
+    The table is the persistent store: at startup every active slot is
+    rebuilt from it, and each job reads the slot's messages when it fires,
+    so thousands of schedules at the same minute share a single job.
+    """
+
+    def __init__(self, scheduler, deliver):
+        self.scheduler = scheduler
+        self.deliver = deliver
+
+    @staticmethod
+    def job_id(time):
+        return f'schedule-slot-{time}'
+
+    def rehydrate(self):
+        """Bring the slot jobs in line with the table; returns the number of active slots.
+
+        Cheap enough to run periodically, which also picks up schedules
+        changed by other worker processes.
+        """
+        times = {row[0] for row in db.query("SELECT DISTINCT time FROM schedules WHERE active=1")}
+        prefix = self.job_id('')
+        jobs = {job.id for job in self.scheduler.get_jobs() if job.id.startswith(prefix)}
+        for time in times:
+            if self.job_id(time) not in jobs:
+                self._add_slot(time)
+        for job_id in jobs - {self.job_id(time) for time in times}:
+            self.scheduler.remove_job(job_id)
+        return len(times)
+
+    def _add_slot(self, time):
+        hour, minute = time.split(':')
+        self.scheduler.add_job(self.run_slot, 'cron', hour=int(hour), minute=int(minute), args=[time],
+                               id=self.job_id(time), replace_existing=True, misfire_grace_time=60, coalesce=True)
+
+    def sync_slot(self, time):
+        """Make the slot's job match the table after a schedule changes."""
+        if db.query_one("SELECT 1 FROM schedules WHERE active=1 AND time=? LIMIT 1", (time,)):
+            if self.scheduler.get_job(self.job_id(time)) is None:
+                self._add_slot(time)
+        elif self.scheduler.get_job(self.job_id(time)) is not None:
+            self.scheduler.remove_job(self.job_id(time))
+
+    def run_slot(self, time):
+        for schedule_id, message in db.query("SELECT id, message FROM schedules WHERE active=1 AND time=? ORDER BY id", (time,)):
+            try:
+                self.deliver(message)
+            except Exception as e:
+                print(f'Schedule {schedule_id} at {time} failed: {e}')
+
+    def create(self, time, message, active):
+        time = parse_time(time)
+        schedule_id = db.execute("INSERT INTO schedules (time, message, active) VALUES (?, ?, ?)",
+                                 (time, message, 1 if active else 0)).lastrowid
+        self.sync_slot(time)
+        return schedule_id
+
+    def update(self, schedule_id, time=None, message=None, active=None):
+        """Change a schedule; returns False if it does not exist."""
+        row = db.query_one("SELECT time, message, active FROM schedules WHERE id=?", (schedule_id,))
+        if not row:
+            return False
+        old_time = row[0]
+        new_time = parse_time(time) if time is not None else old_time
+        new_message = message if message is not None else row[1]
+        new_active = (1 if active else 0) if active is not None else row[2]
+        db.execute("UPDATE schedules SET time=?, message=?, active=? WHERE id=?",
+                   (new_time, new_message, new_active, schedule_id))
+        self.sync_slot(new_time)
+        if old_time != new_time:
+            self.sync_slot(old_time)
+        return True
+
+    def delete(self, schedule_id):
+        row = db.query_one("SELECT time FROM schedules WHERE id=?", (schedule_id,))
+        if not row:
+            return False
+        db.execute("DELETE FROM schedules WHERE id=?", (schedule_id,))
+        self.sync_slot(row[0])
+        return True
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import namedtuple
+
+import db
+
+# How often a process asks the DB whether another process changed settings.
+# Between checks, readers never touch the database.
+CHECK_INTERVAL = 5.0
+
+Board = namedtuple('Board', ['id', 'name', 'ip', 'port', 'protocol', 'active', 'width', 'height', 'frames', 'playlist_id'])
+AISettings = namedtuple('AISettings', ['style', 'language', 'tone'])
+
+
+class Settings:
+    """Immutable snapshot of board_settings, ai_settings and the board registry."""
+
+    def __init__(self, version, display, ai, boards):
+        self.version = version
+        self.display = display  # board_settings row 1, as the settings page expects it
+        self.ai = ai
+        self.boards = boards  # {id: Board}
+        self.active_board_ids = [board.id for board in boards.values() if board.active]
+
+    def board(self, board_id):
+        return self.boards.get(board_id)
+
+
+class SettingsCache:
+    """Process-wide settings cache.
+
+    Writes in this process call refresh() (write-through). Writes anywhere
+    bump settings_version through triggers, which other processes notice
+    on their next version check.
+    """
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.snapshot = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self.checked < self.check_interval:
+            return snapshot
+        with self.lock:
+            if self.snapshot is None or time.monotonic() - self.checked >= self.check_interval:
+                version = db.query_one("SELECT version FROM settings_version WHERE id=1")[0]
+                if self.snapshot is None or self.snapshot.version != version:
+                    self.snapshot = self._load(version)
+                self.checked = time.monotonic()
+            return self.snapshot
+
+    def refresh(self):
+        with self.lock:
+            version = db.query_one("SELECT version FROM settings_version WHERE id=1")[0]
+            self.snapshot = self._load(version)
+            self.checked = time.monotonic()
+            return self.snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshot = None
+
+    def _load(self, version):
+        display = db.query_one("SELECT * FROM board_settings WHERE id=1")
+        ai = db.query_one("SELECT style, language, tone FROM ai_settings WHERE id=1")
+        boards = {row[0]: Board(*row) for row in
+                  db.query("SELECT id, name, ip, port, protocol, active, width, height, frames, playlist_id FROM boards ORDER BY id")}
+        return Settings(version, display, AISettings(*ai) if ai else None, boards)
@@ -0,0 +1,195 @@
+import itertools
+import select
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# Bounded timeouts so a stalled P10 controller can never hang a caller
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 5
+
+# Messages on a persistent TCP connection are newline-framed, since the
+# controller can no longer rely on the socket closing to end a message
+TCP_DELIMITER = b'\n'
+# Binary frames on TCP start with STX and a big-endian length, which never
+# collides with a newline-terminated text message
+TCP_FRAME_START = b'\x02'
+
+# Connection generations are unique across transports, so a board whose
+# transport was rebuilt is never mistaken for the connection before it
+_generations = itertools.count(1)
+
+SendResult = namedtuple('SendResult', ['ok', 'elapsed', 'error'])
+
+SEND_SECONDS = metrics.Histogram('ledboard_board_send_seconds', 'Time to hand a message or frame to a board.',
+                                 ('protocol', 'outcome'))
+
+
+class HttpTransport:
+    """Keep-alive HTTP session to one board's /display endpoint."""
+
+    def __init__(self, ip, port):
+        self.url = f'http://{ip}:{port}/display'
+        self.frame_url = f'http://{ip}:{port}/frame'
+        # Changed whenever the board may have lost state the caller relies on
+        self.generation = next(_generations)
+        self.session = requests.Session()
+        # Retry only failed connects; a POST that reached the board is never resent
+        retries = Retry(total=1, connect=1, read=0, status=0, other=0)
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retries))
+
+    def send(self, message):
+        self._post(self.url, json={'message': message})
+
+    def send_frame(self, encode):
+        """Send the frame encode(generation) returns; returns the generation it was encoded for."""
+        generation = self.generation
+        self._post(self.frame_url, data=encode(generation), headers={'Content-Type': 'application/octet-stream'})
+        return generation
+
+    def _post(self, url, **kwargs):
+        try:
+            response = self.session.post(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.generation = next(_generations)
+            raise
+
+    def close(self):
+        self.session.close()
+
+
+class TcpTransport:
+    """Persistent TCP socket to one board, reconnected on failure."""
+
+    def __init__(self, ip, port):
+        self.address = (ip, int(port))
+        self.sock = None
+        # Changes on every connection, so callers can tell the board saw a reconnect
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=CONNECT_TIMEOUT)
+        sock.settimeout(READ_TIMEOUT)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = sock
+        self.generation = next(_generations)
+
+    def _drop(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _peer_closed(self):
+        # A closed idle connection still accepts sendall() into the kernel
+        # buffer, so the loss would go unnoticed; look for the EOF first
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            return bool(readable) and self.sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+
+    def send(self, message):
+        data = message.encode() + TCP_DELIMITER
+        self._send_bytes(lambda generation: data)
+
+    def send_frame(self, encode):
+        """Send the frame encode(generation) returns; returns the generation it was encoded for.
+
+        encode is called once the connection is up, and again if the frame
+        has to be resent on a new one, so it always sees the connection the
+        bytes actually go out on.
+        """
+        def build(generation):
+            frame = encode(generation)
+            return TCP_FRAME_START + struct.pack('>I', len(frame)) + frame
+        return self._send_bytes(build)
+
+    def _send_bytes(self, build):
+        with self.lock:
+            if self.sock is not None and self._peer_closed():
+                self._drop()
+            reused = self.sock is not None
+            if not reused:
+                self._connect()
+            try:
+                self.sock.sendall(build(self.generation))
+            except OSError:
+                self._drop()
+                if not reused:
+                    raise
+                # The board closed an idle connection; reconnect once and resend
+                self._connect()
+                try:
+                    self.sock.sendall(build(self.generation))
+                except OSError:
+                    self._drop()
+                    raise
+            return self.generation
+
+    def close(self):
+        with self.lock:
+            self._drop()
+
+
+TRANSPORTS = {'HTTP': HttpTransport, 'TCP': TcpTransport}
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def get_transport(ip, port, protocol):
+    """Return the shared transport for a board, creating it on first use."""
+    key = (ip, int(port), protocol)
+    with _pool_lock:
+        transport = _pool.get(key)
+        if transport is None:
+            transport = TRANSPORTS[protocol](ip, port)
+            _pool[key] = transport
+        return transport
+
+
+def send(ip, port, protocol, message):
+    """Deliver a message to a board and report whether it succeeded and how long it took.
+
+    A bytes message is sent as a packed renderer frame instead of text. So
+    is a callable, which is called with the connection generation and must
+    return the frame bytes (see frame_diff.FrameStream).
+    """
+    if protocol not in TRANSPORTS:
+        return SendResult(False, 0.0, f'Unknown protocol: {protocol}')
+    start = time.perf_counter()
+    try:
+        board = get_transport(ip, port, protocol)
+        if isinstance(message, bytes):
+            board.send_frame(lambda generation: message)
+        elif callable(message):
+            board.send_frame(message)
+        else:
+            board.send(message)
+    except (OSError, requests.RequestException) as e:
+        elapsed = time.perf_counter() - start
+        SEND_SECONDS.observe(elapsed, protocol, 'error')
+        return SendResult(False, elapsed, str(e))
+    elapsed = time.perf_counter() - start
+    SEND_SECONDS.observe(elapsed, protocol, 'ok')
+    return SendResult(True, elapsed, None)
+
+
+def close_all():
+    with _pool_lock:
+        for transport in _pool.values():
+            transport.close()
+        _pool.clear()
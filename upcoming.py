@@ -0,0 +1,51 @@
+import calendar
+from datetime import date, timedelta
+
+# birthdays.birth_md holds month * 100 + day so a calendar window is an
+# indexed integer range; in non-leap years 29 Feb birthdays fall on 28 Feb
+BIRTH_MD_SQL = "CAST(substr({dob}, 6, 2) AS INTEGER) * 100 + CAST(substr({dob}, 9, 2) AS INTEGER)"
+
+
+def birth_md(dob):
+    """Month-day key for a YYYY-MM-DD date of birth."""
+    return int(dob[5:7]) * 100 + int(dob[8:10])
+
+
+def _md_ranges(start, end):
+    """Yield (low, high) birth_md ranges covering start..end, split at year ends."""
+    while start <= end:
+        stop = min(end, date(start.year, 12, 31))
+        low = start.month * 100 + start.day
+        high = stop.month * 100 + stop.day
+        if not calendar.isleap(start.year) and high == 228:
+            high = 229
+        yield low, high
+        start = stop + timedelta(days=1)
+
+
+def next_birthday(dob, today):
+    """Date of the next birthday on or after today."""
+    month, day = int(dob[5:7]), int(dob[8:10])
+    for year in (today.year, today.year + 1):
+        if month == 2 and day == 29 and not calendar.isleap(year):
+            candidate = date(year, 2, 28)
+        else:
+            candidate = date(year, month, day)
+        if candidate >= today:
+            return candidate
+
+
+def upcoming_birthdays(conn, today, days):
+    """Return [(name, dob, days until birthday)] for the next `days` days, soonest first."""
+    ranges = list(_md_ranges(today, today + timedelta(days=days)))
+    query = ' UNION '.join(["SELECT id, name, dob FROM birthdays WHERE birth_md BETWEEN ? AND ?"] * len(ranges))
+    params = [bound for pair in ranges for bound in pair]
+    c = conn.cursor()
+    c.execute(query, params)
+    results = []
+    for _, name, dob in c.fetchall():
+        when = next_birthday(dob, today)
+        if when is not None and (when - today).days <= days:
+            results.append((name, dob, (when - today).days))
+    results.sort(key=lambda row: row[2])
+    return results